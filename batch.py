@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import sys
+from multiprocessing import Pool
+
+from cache import CompileCache
+from compiler import compile_to_asua
+
+
+# ============================================================
+# COMPILACIÓN EN LOTE (JSONL)
+# ============================================================
+#
+# Entrada: una expresión por línea, como objeto {"expr": "...", ...}
+# o directamente como string JSON. Los demás campos (id, etc.) se copian
+# a la salida. Salida: una línea por entrada, en el mismo orden, con
+# "code" y "stats", o con "error" si esa expresión no compiló.
+
+# caché de cada proceso (ver init_worker)
+CACHE = None
+
+
+def init_worker(cache_path, cache_size):
+    global CACHE
+    CACHE = CompileCache(cache_size, cache_path)
+
+
+def parse_job(line):
+    job = json.loads(line)
+    if isinstance(job, str):
+        job = {"expr": job}
+    if not isinstance(job, dict) or "expr" not in job:
+        raise ValueError("Se esperaba un objeto con campo 'expr'")
+    return job
+
+
+def compile_job(args):
+    # corre en los procesos del pool: nunca levanta excepción
+    n, line, options = args
+    try:
+        job = parse_job(line)
+    except ValueError as e:
+        return {"line": n, "error": f"JSON inválido: {e}"}
+
+    out = {k: v for k, v in job.items() if k != "expr"}
+    out["line"] = n
+    try:
+        if CACHE is not None:
+            code, stats = CACHE.compile(job["expr"], **options)
+        else:
+            code, stats = compile_to_asua(job["expr"], **options)
+    except Exception as e:
+        out["error"] = f"{type(e).__name__}: {e}"
+        return out
+    out["code"] = code
+    out["stats"] = stats
+    return out
+
+
+def read_jobs(fin, options):
+    for n, line in enumerate(fin, 1):
+        line = line.strip()
+        if line:
+            yield n, line, options
+
+
+def compile_batch(fin, fout, workers=None, chunksize=16, cache_path=None,
+                  cache_size=None, **options):
+    # fin/fout: archivos abiertos. Los resultados se escriben a medida que
+    # llegan, respetando el orden de entrada. Devuelve (ok, errores).
+    # cache_path / cache_size: activan el caché de compilación (en disco y
+    # en memoria de cada proceso)
+    ok = failed = 0
+    jobs = read_jobs(fin, options)
+
+    init = (cache_path, cache_size or 4096) if cache_path or cache_size else None
+    if workers == 1:
+        if init:
+            init_worker(*init)
+        results = map(compile_job, jobs)
+        pool = None
+    elif init:
+        pool = Pool(workers or os.cpu_count(), init_worker, init)
+        results = pool.imap(compile_job, jobs, chunksize)
+    else:
+        pool = Pool(workers or os.cpu_count())
+        results = pool.imap(compile_job, jobs, chunksize)
+
+    try:
+        for res in results:
+            if "error" in res:
+                failed += 1
+            else:
+                ok += 1
+            fout.write(json.dumps(res, ensure_ascii=False) + "\n")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return ok, failed
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Compila a ASUA un JSONL de expresiones")
+    ap.add_argument("input", help="JSONL de entrada ('-' para stdin)")
+    ap.add_argument("output", nargs="?", default="-", help="JSONL de salida ('-' para stdout)")
+    ap.add_argument("-j", "--workers", type=int, default=None,
+                    help="procesos (por defecto, uno por núcleo)")
+    ap.add_argument("--chunksize", type=int, default=16)
+    ap.add_argument("--cache", metavar="DIR", default=None,
+                    help="directorio del caché de compilación en disco")
+    ap.add_argument("--cache-size", type=int, default=None,
+                    help="entradas del caché en memoria por proceso")
+    ap.add_argument("-O", dest="level", choices=("0", "1", "2", "s"), default=None,
+                    help="nivel de optimización (por defecto el de compiler.py)")
+    args = ap.parse_args()
+
+    fin = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    fout = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        ok, failed = compile_batch(fin, fout, args.workers, args.chunksize,
+                                   args.cache, args.cache_size, level=args.level)
+    finally:
+        if fin is not sys.stdin:
+            fin.close()
+        if fout is not sys.stdout:
+            fout.close()
+
+    print(f"# {ok} compiladas, {failed} con error", file=sys.stderr)
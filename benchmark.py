@@ -0,0 +1,327 @@
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+
+import compiler
+from compiler import (compile_to_asua, fold_binop, fold_func, is_const, parse_result,
+                      simplify_node, walk_tree)
+from simulator import INPUTS, Program
+
+
+# ============================================================
+# CORPUS DE BENCHMARK
+# ============================================================
+#
+# Cambiar el corpus o las entradas => subir CORPUS_VERSION y regenerar
+# el baseline con --update.
+
+CORPUS_VERSION = 4
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+CORPUS = [
+    ("add",          "result = a + b"),
+    ("sub",          "result = a - b"),
+    ("neg",          "result = -a"),
+    ("neg_sub",      "result = -(a - b)"),
+    ("mul",          "result = a * b"),
+    ("mul_const",    "result = a * 10"),
+    ("mul_neg",      "result = a * -3"),
+    ("div",          "result = a / b"),
+    ("div_pow2",     "result = a / 8"),
+    ("div_const",    "result = a / 10"),
+    ("mod",          "result = a % b"),
+    ("mod_pow2",     "result = a % 16"),
+    ("mod_const",    "result = a % 10"),
+    ("max",          "result = max(a, b)"),
+    ("min",          "result = min(a, b)"),
+    ("abs",          "result = abs(a)"),
+    ("const_fold",   "result = (3 + 4) * 5 - a"),
+    ("zero_fold",    "result = a * 0 + (b - 0) + 0 * c"),
+    ("nested_mul",   "result = (a * b) * (c * d)"),
+    ("nested_div",   "result = (a / b) / (c + 1)"),
+    ("mul_div_mod",  "result = (a * b) / c + (a * b) % c"),
+    ("digits",       "result = (a / 10) + (a % 10)"),
+    ("maxmin",       "result = max(a, b) - min(a, b)"),
+    ("abs_mod",      "result = abs(a) % b"),
+    ("cse",          "result = (a * b) + max(a * b, c)"),
+    ("spill",        "result = (a + b) - (c - (d + e))"),
+    ("mixed",        "result = max(a * b, c) - abs(d) / e"),
+    ("deep",         "result = ((a + b) * (c - d)) / (abs(e) + 1) + min(f, -g)"),
+    # B vivo mientras se multiplica por una potencia de 2 negativa
+    ("mul_neg_pow2", "result = max(a, b) + c * -2"),
+    ("sub_neg_pow2", "result = (a + b) - c * -4"),
+    # dividendo de más de 8 bits: - no chequea por abajo
+    ("wide_div",     "result = -(a - b - c) / 3"),
+    ("wide_mod",     "result = -(a - b - c) % 3"),
+    # abs(a)/1 puede valer 128: el + 0 tiene que quedar
+    ("div_plus_zero", "result = abs(a) / 1 + 0"),
+]
+
+
+def input_vectors(n=16):
+    # entradas fijas: chicas para que no todo termine en overflow, y una
+    # en los extremos
+    rng = random.Random(CORPUS_VERSION)
+    vecs = [
+        {v: 0 for v in INPUTS},
+        {v: 1 for v in INPUTS},
+        {v: -1 for v in INPUTS},
+        dict({v: 127 for v in INPUTS}, a=-128),
+    ]
+    while len(vecs) < n:
+        vecs.append({v: rng.randint(-12, 12) for v in INPUTS})
+    return vecs
+
+
+# ============================================================
+# MEDICIÓN
+# ============================================================
+
+METRICS = ("lines", "reads", "writes", "cycles", "max_cycles")
+
+
+def expected(expr, inputs):
+    # (result, error) del árbol sin simplificar, para probar también
+    # simplify: fold_binop levanta ValueError donde el programa salta a la
+    # rutina de error. Un subárbol que simplify deja constante vale eso sin
+    # error (x*0 -> 0 descarta los errores de x)
+    def combine(node, args):
+        # (valor, o None si hubo error; subárbol simplificado)
+        simple = simplify_node(node, [s for _, s in args])
+        kind = node[0]
+        if kind == "var":
+            return inputs[node[1]], simple
+        if is_const(simple):
+            return simple[1], simple
+        xs = [v for v, _ in args]
+        if None in xs:
+            return None, simple
+        try:
+            if kind == "neg":
+                return -xs[0], simple
+            if kind == "func":
+                return fold_func(node[1], xs), simple
+            return fold_binop(node[1], *xs), simple
+        except ValueError:
+            return None, simple
+
+    try:
+        value, _ = walk_tree(parse_result(expr), combine)
+    except ValueError:
+        return 0, 1
+    return (0, 1) if value is None else (value, 0)
+
+
+def measure(expr, vectors, **options):
+    code, stats = compile_to_asua(expr, **options)
+    prog = Program(code)
+    runs = [prog.run(v) for v in vectors]
+    cycles = [r["cycles"] for r in runs]
+    # entradas con las que el programa da otra cosa que la referencia
+    wrong = [v for v, r in zip(vectors, runs) if (r["result"], r["error"]) != expected(expr, v)]
+    return {
+        "wrong": wrong,
+        "lines": stats["lines"],
+        "reads": stats["reads"],
+        "writes": stats["writes"],
+        "cycles": sum(cycles) / len(cycles),
+        "max_cycles": max(cycles),
+    }
+
+
+def run_corpus(**options):
+    vectors = input_vectors()
+    return {name: measure(expr, vectors, **options) for name, expr in CORPUS}
+
+
+def check_corpus():
+    # (nivel, nombre, entradas) de cada resultado incorrecto, en todos los
+    # niveles de optimización
+    wrong = []
+    for level in compiler.OPT_LEVELS:
+        for name, metrics in run_corpus(level=level).items():
+            wrong += [(level, name, v) for v in metrics["wrong"]]
+    return wrong
+
+
+def compare(baseline, current, threshold):
+    # regresiones: (nombre, métrica, antes, ahora) que empeoran más que
+    # threshold (fracción) respecto del baseline
+    regressions = []
+    for name, metrics in current.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        for m in METRICS:
+            before, now = old[m], metrics[m]
+            if now > before * (1 + threshold) and now - before >= 1:
+                regressions.append((name, m, before, now))
+    return regressions
+
+
+def load_baseline(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("corpus_version") != CORPUS_VERSION:
+        raise ValueError(
+            f"Baseline de la versión {data.get('corpus_version')} del corpus, "
+            f"se esperaba {CORPUS_VERSION}: regenerar con --update")
+    return data["metrics"]
+
+
+def save_baseline(path, metrics):
+    data = {
+        "corpus_version": CORPUS_VERSION,
+        "compiler_version": compiler.COMPILER_VERSION,
+        "metrics": {name: {m: v[m] for m in METRICS} for name, v in metrics.items()},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+        f.write("\n")
+
+
+def print_table(current, baseline=None, out=sys.stdout):
+    print(f"{'caso':<14}" + "".join(f"{m:>12}" for m in METRICS), file=out)
+    for name, metrics in current.items():
+        row = f"{name:<14}"
+        for m in METRICS:
+            cell = f"{metrics[m]:.1f}" if isinstance(metrics[m], float) else str(metrics[m])
+            if baseline and name in baseline and baseline[name][m] != metrics[m]:
+                delta = metrics[m] - baseline[name][m]
+                cell += f"({delta:+.0f})"
+            row += f"{cell:>12}"
+        print(row, file=out)
+
+
+def print_tradeoff(out=sys.stdout):
+    # ROM contra ciclos: cada caso con todo en el lugar y en modo tamaño
+    inline = run_corpus()
+    small = run_corpus(size=True)
+    print(f"{'caso':<14}{'lines':>8}{'cycles':>10}{'lines(size)':>14}{'cycles(size)':>14}", file=out)
+    for name, m in inline.items():
+        s = small[name]
+        print(f"{name:<14}{m['lines']:>8}{m['cycles']:>10.1f}{s['lines']:>14}{s['cycles']:>14.1f}", file=out)
+    total = {k: sum(m[k] for m in inline.values()) for k in ("lines", "cycles")}
+    total_s = {k: sum(m[k] for m in small.values()) for k in ("lines", "cycles")}
+    print(f"{'total':<14}{total['lines']:>8}{total['cycles']:>10.1f}"
+          f"{total_s['lines']:>14}{total_s['cycles']:>14.1f}", file=out)
+
+
+# ============================================================
+# ESCALA
+# ============================================================
+#
+# Tiempo de compilar (en O2, con todos los pases) formas generadas de
+# tamaño n y SCALE_STEP*n. Cada forma tiene saltos: max/min, * y / en
+# línea y subrutinas, para que los pases de asm vean muchos bloques y no
+# solo código recto. Compilar es lineal salvo los heaps de los pases:
+# el tiempo puede crecer a lo sumo SCALE_LIMIT veces más que el tamaño.
+
+SCALE_STEP = 4
+SCALE_LIMIT = 1.5
+
+
+def scale_term(rng):
+    # operando distinto en cada término, para que ir_cse no los junte
+    return f"({rng.choice(INPUTS)} + {rng.randint(-100, 100)})"
+
+
+SCALE_SHAPES = {
+    "sum_mul_max": lambda rng, n: " + ".join(
+        f"max({rng.choice(INPUTS)}, {rng.randint(-100, 100)}) * {rng.choice(INPUTS)}"
+        for _ in range(n)),
+    "nested_max":  lambda rng, n: "".join(
+        f"max({scale_term(rng)} * {rng.choice(INPUTS)}, " for _ in range(n))
+        + rng.choice(INPUTS) + ")" * n,
+    "div_mod":     lambda rng, n: " - ".join(
+        f"{scale_term(rng)} / {rng.choice(INPUTS)} + abs{scale_term(rng)} % {rng.randint(2, 9)}"
+        for _ in range(n)),
+}
+
+
+def compile_time(expr, repeat=2):
+    # el mejor de repeat, sin el recolector de ciclos: su costo crece con
+    # todo lo que está vivo, no con lo que hace el compilador
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            t0 = time.perf_counter()
+            compile_to_asua(expr, level="O2", text=False)
+            elapsed = time.perf_counter() - t0
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def check_scaling(n=200, out=sys.stdout):
+    # formas cuyo tiempo crece más que lo permitido, con su factor
+    slow = []
+    print(f"{'forma':<14}{'n':>6}{'s':>9}{SCALE_STEP * n:>8}{'s':>9}{'factor':>9}", file=out)
+    for name, shape in SCALE_SHAPES.items():
+        times = []
+        for size in (n, SCALE_STEP * n):
+            expr = "result = " + shape(random.Random(size), size)
+            times.append(compile_time(expr))
+        growth = times[1] / times[0] / SCALE_STEP
+        print(f"{name:<14}{n:>6}{times[0]:>9.2f}{SCALE_STEP * n:>8}{times[1]:>9.2f}{growth:>9.2f}",
+              file=out)
+        if growth > SCALE_LIMIT:
+            slow.append((name, growth))
+    return slow
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmark de calidad del código generado")
+    ap.add_argument("--baseline", default=BASELINE)
+    ap.add_argument("--threshold", type=float, default=0.05,
+                    help="empeoramiento tolerado por métrica (fracción, por defecto 0.05)")
+    ap.add_argument("--update", action="store_true", help="reescribe el baseline")
+    ap.add_argument("--size", action="store_true",
+                    help="compara ROM y ciclos contra el modo tamaño (size=True)")
+    ap.add_argument("--scaling", type=int, nargs="?", const=200, default=None, metavar="N",
+                    help="tiempo de compilación con entradas de tamaño N y %d*N" % SCALE_STEP)
+    args = ap.parse_args()
+
+    if args.size:
+        print_tradeoff()
+        sys.exit(0)
+
+    if args.scaling is not None:
+        slow = check_scaling(args.scaling)
+        for name, growth in slow:
+            print(f"# NO LINEAL {name}: {growth:.2f}")
+        sys.exit(1 if slow else 0)
+
+    current = run_corpus()
+
+    # un resultado incorrecto en cualquier nivel corta antes del baseline
+    wrong = check_corpus()
+    for level, name, inputs in wrong:
+        print(f"# INCORRECTO {name} ({level}): {inputs}")
+    if wrong:
+        sys.exit(1)
+
+    if args.update:
+        save_baseline(args.baseline, current)
+        print_table(current)
+        print(f"# baseline guardado en {args.baseline}")
+        sys.exit(0)
+
+    baseline = load_baseline(args.baseline)
+    print_table(current, baseline)
+
+    regressions = compare(baseline, current, args.threshold)
+    missing = [name for name, _ in CORPUS if name not in baseline]
+    for name in missing:
+        print(f"# sin baseline: {name}")
+    for name, m, before, now in regressions:
+        print(f"# REGRESIÓN {name}.{m}: {before} -> {now}")
+    sys.exit(1 if regressions else 0)
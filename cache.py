@@ -0,0 +1,186 @@
+import copy
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+from collections import OrderedDict
+
+import compiler
+from compiler import compile_ast, parse_result, simplify, walk_tree
+
+
+# ============================================================
+# FORMA CANÓNICA
+# ============================================================
+#
+# Solo para la clave: se compila siempre el árbol que llegó. Dos árboles
+# con la misma forma canónica dan el mismo resultado y error, así que
+# pueden compartir el código. En * no se ordena: el lazo da una vuelta
+# por bit del operando derecho. Con la división por resta repetida no se
+# ordena nada: un divisor negativo no termina y adelantar esa división
+# puede colgar un programa que terminaba con error (ver pass_order).
+
+ORDERED = ("+", "max", "min")
+
+
+def canonical(node, ordered=ORDERED):
+    # devuelve (árbol, texto) canónicos; en los operadores de ordered los
+    # operandos quedan ordenados por su texto, así a+b y b+a dan la misma
+    # clave
+    return walk_tree(node, lambda node, args: canonical_node(node, args, ordered))
+
+
+def canonical_node(node, args, ordered=ORDERED):
+    # args: (árbol, texto) canónicos de los hijos
+    kind = node[0]
+
+    if kind == "var":
+        return node, node[1]
+
+    if kind == "const":
+        return node, str(node[1])
+
+    if kind == "neg":
+        x, k = args[0]
+        return ("neg", x), f"-({k})"
+
+    if kind == "func":
+        if node[1] in ordered:
+            args.sort(key=lambda a: a[1])
+        text = node[1] + "(" + ",".join(k for _, k in args) + ")"
+        return ("func", node[1], [a for a, _ in args]), text
+
+    op = node[1]
+    L, R = args
+    if op in ordered and R[1] < L[1]:
+        L, R = R, L
+    return ("binop", op, L[0], R[0]), f"({L[1]}{op}{R[1]})"
+
+
+def normalize_options(options):
+    # completa con los valores por defecto para que dos llamadas
+    # equivalentes den la misma clave
+    opts = {
+        name: p.default
+        for name, p in inspect.signature(compile_ast).parameters.items()
+        if p.default is not inspect.Parameter.empty
+    }
+    opts.update(options)
+    # con el nivel resuelto, -O1 y las mismas opciones a mano dan la misma
+    # clave
+    level = opts.pop("level")
+    opts.update(compiler.level_options(level, **{k: opts[k] for k in compiler.OPT_LEVELS[compiler.DEFAULT_LEVEL]}))
+    opts["mul"] = opts["mul"] or compiler.MUL_STRATEGY
+    opts["div"] = opts["div"] or compiler.DIV_STRATEGY
+    if opts["peephole"] not in (True, False, None):
+        opts["peephole"] = sorted(opts["peephole"])
+    return opts
+
+
+SOURCE_HASH = None
+
+
+def source_hash():
+    # el fuente de compiler.py: si un cambio en el código generado no sube
+    # COMPILER_VERSION, el caché en disco igual deja de servir lo viejo
+    global SOURCE_HASH
+    if SOURCE_HASH is None:
+        with open(compiler.__file__, "rb") as f:
+            SOURCE_HASH = hashlib.sha256(f.read()).hexdigest()
+    return SOURCE_HASH
+
+
+def config_hash():
+    # todo lo que cambia el código generado sin estar en las opciones
+    conf = json.dumps([compiler.COMPILER_VERSION, source_hash(), compiler.IMMEDIATE_ZERO,
+                       compiler.superopt_table()], sort_keys=True)
+    return hashlib.sha256(conf.encode()).hexdigest()[:16]
+
+
+# ============================================================
+# CACHÉ LRU + DISCO
+# ============================================================
+
+class CompileCache:
+    def __init__(self, maxsize=4096, path=None):
+        # maxsize: entradas en memoria; path: directorio del caché en disco
+        # (None = solo memoria)
+        self.maxsize = maxsize
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    def counters(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "evictions": self.evictions,
+            "size": len(self.entries),
+        }
+
+    def key(self, ast, options):
+        opts = normalize_options(options)
+        _, text = canonical(ast, () if opts["div"] == "repeat" else ORDERED)
+        return json.dumps([text, opts], sort_keys=True)
+
+    def disk_file(self, conf, key):
+        name = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.path, conf, name + ".json")
+
+    def disk_get(self, conf, key):
+        try:
+            with open(self.disk_file(conf, key), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # colisión de hash: la clave completa va guardada
+        if entry.get("key") != key:
+            return None
+        return entry["code"], entry["stats"]
+
+    def disk_put(self, conf, key, code, stats):
+        fname = self.disk_file(conf, key)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fname), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "code": code, "stats": stats}, f)
+        os.replace(tmp, fname)
+
+    def remember(self, mkey, value):
+        self.entries[mkey] = value
+        self.entries.move_to_end(mkey)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def compile(self, expr, **options):
+        # el caché guarda siempre el código como texto
+        options["text"] = True
+        ast = simplify(parse_result(expr))
+        conf = config_hash()
+        key = self.key(ast, options)
+        mkey = (conf, key)
+
+        value = self.entries.get(mkey)
+        if value is not None:
+            self.hits += 1
+            self.entries.move_to_end(mkey)
+        else:
+            if self.path is not None:
+                value = self.disk_get(conf, key)
+            if value is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                value = compile_ast(ast, **options)
+                if self.path is not None:
+                    self.disk_put(conf, key, *value)
+            self.remember(mkey, value)
+
+        code, stats = value
+        return list(code), copy.deepcopy(stats)
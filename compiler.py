@@ -1,7 +1,26 @@
+import argparse
+import heapq
+import json
+import os
 import re
+import sys
+import time
+from array import array
+
+# cambia cada vez que cambia el código generado (invalida cachés en disco)
+COMPILER_VERSION = "2.13"
 
 IMMEDIATE_ZERO = True
 
+# multiplicación: "shift" (shift-and-add), "min" (suma repetida sobre el
+# operando menor) o "add" (suma repetida sobre b)
+MUL_STRATEGY = "shift"
+
+# división y módulo: "binary" (shift-subtract, una vuelta por bit de la
+# cota del dividendo, al menos 8) o
+# "repeat" (resta repetida, tantas vueltas como el cociente)
+DIV_STRATEGY = "binary"
+
 
 # ============================================================
 # LEXER
@@ -15,7 +34,8 @@ TOKEN_SPEC = [
     ("RPAREN", r"\)"),
     ("COMMA",  r","),
     ("EQ",     r"="),
-    ("SKIP",   r"[ \t]+"),
+    ("SEP",    r"[;\n]"),
+    ("SKIP",   r"[ \t\r]+"),
 ]
 
 MASTER_RE = re.compile(
@@ -23,295 +43,1235 @@ MASTER_RE = re.compile(
 )
 
 
-class Token:
-    def __init__(self, typ, val):
-        self.type = typ
-        self.val = val
-
-
 def lex(s):
-    tokens = []
+    # flujo de tokens (tipo, texto); no arma la lista entera
     for m in MASTER_RE.finditer(s):
         typ = m.lastgroup
         if typ != "SKIP":
-            tokens.append(Token(typ, m.group(typ)))
-    return tokens
+            yield typ, m.group(typ)
 
 
 # ============================================================
 # PARSER
 # ============================================================
+#
+# Precedencia de operadores con pilas explícitas en vez de descenso
+# recursivo: las expresiones generadas por máquina pueden tener miles de
+# niveles de anidamiento y la recursión de Python no da. El menos unario
+# liga más fuerte que cualquier binario (-a*b es (-a)*b).
+
+PRECEDENCE = {"+": 1, "-": 1, "*": 2, "/": 2, "%": 2}
+FUNC_ARITY = {"max": 2, "min": 2, "abs": 1}
+
+EOF = ("EOF", "")
+
+# marcas en la pila de operadores (los binarios van como "+", "*", ...)
+NEG = ("neg",)
+OPEN = ("(",)
+
 
 class Parser:
     def __init__(self, tokens):
-        self.tokens = tokens
-        self.pos = 0
+        self.tokens = iter(tokens)
+        self.tok = next(self.tokens, EOF)
 
     def cur(self):
-        return self.tokens[self.pos] if self.pos < len(self.tokens) else Token("EOF", "")
+        return self.tok
 
     def eat(self, typ=None, val=None):
-        tok = self.cur()
-        if typ and tok.type != typ:
-            raise ValueError(f"Esperaba {typ}, llegó {tok}")
-        if val and tok.val != val:
-            raise ValueError(f"Esperaba '{val}', llegó '{tok.val}'")
-        self.pos += 1
+        tok = self.tok
+        if typ and tok[0] != typ:
+            raise ValueError(f"Esperaba {typ}, llegó {tok[0]} '{tok[1]}'")
+        if val and tok[1] != val:
+            raise ValueError(f"Esperaba '{val}', llegó '{tok[1]}'")
+        self.tok = next(self.tokens, EOF)
         return tok
 
     def parse_assignment(self):
-        left = self.eat("ID").val
+        left = self.eat("ID")[1]
         self.eat("EQ")
         expr = self.parse_expr()
         return left, expr
 
-    def parse_expr(self):
-        node = self.parse_term()
-        while self.cur().type == "OP" and self.cur().val in ("+", "-"):
-            op = self.eat("OP").val
-            node = ("binop", op, node, self.parse_term())
-        return node
+    def parse_program(self):
+        # sentencias "nombre = expr" separadas por ";" o fin de línea
+        stmts = []
+        while self.tok != EOF:
+            if self.tok[0] == "SEP":
+                self.eat()
+                continue
+            stmts.append(self.parse_assignment())
+            if self.tok[0] not in ("SEP", "EOF"):
+                raise ValueError(f"Esperaba fin de sentencia, llegó {self.tok[0]} '{self.tok[1]}'")
+        if not stmts:
+            raise ValueError("Programa vacío")
+        return stmts
+
+    def reduce(self, operands, ops, prec):
+        # arma los binarios pendientes de precedencia >= prec
+        while ops and isinstance(ops[-1], str) and PRECEDENCE[ops[-1]] >= prec:
+            op = ops.pop()
+            R = operands.pop()
+            L = operands.pop()
+            operands.append(("binop", op, L, R))
 
-    def parse_term(self):
-        node = self.parse_factor()
-        while self.cur().type == "OP" and self.cur().val in ("*", "/", "%"):
-            op = self.eat("OP").val
-            node = ("binop", op, node, self.parse_factor())
-        return node
-
-    def parse_factor(self):
-        tok = self.cur()
-
-        if tok.type == "OP" and tok.val == "-":
-            self.eat("OP")
-            return ("neg", self.parse_factor())
-
-        if tok.type == "ID":
-            name = self.eat("ID").val
-            if self.cur().type == "LPAREN":
-                self.eat("LPAREN")
-                args = []
-                if name.lower() in ("max", "min"):
-                    args.append(self.parse_expr())
-                    self.eat("COMMA")
-                    args.append(self.parse_expr())
-                elif name.lower() == "abs":
-                    args.append(self.parse_expr())
+    def parse_expr(self):
+        # operands: nodos ya armados
+        # ops: binarios pendientes, NEG, OPEN y ("call", nombre, base) con
+        # base = cuántos operandos había al abrir la llamada
+        operands = []
+        ops = []
+
+        while True:
+            # ---- se espera un operando ----
+            typ, val = self.tok
+            if typ == "OP" and val == "-":
+                self.eat()
+                typ, val = self.tok
+                # -128 es el único literal que solo existe negado
+                if typ == "NUMBER" and int(val) == 128:
+                    self.eat()
+                    operands.append(("const", -128))
                 else:
-                    raise ValueError(f"Función no soportada: {name}")
-                self.eat("RPAREN")
-                return ("func", name.lower(), args)
-            return ("var", name)
-
-        if tok.type == "LPAREN":
-            self.eat("LPAREN")
-            node = self.parse_expr()
-            self.eat("RPAREN")
-            return node
+                    ops.append(NEG)
+                    continue
+            elif typ == "ID":
+                self.eat()
+                if self.tok[0] == "LPAREN":
+                    if val.lower() not in FUNC_ARITY:
+                        raise ValueError(f"Función no soportada: {val}")
+                    self.eat()
+                    ops.append(("call", val.lower(), len(operands)))
+                    continue
+                operands.append(("var", val))
+            elif typ == "LPAREN":
+                self.eat()
+                ops.append(OPEN)
+                continue
+            elif typ == "NUMBER":
+                self.eat()
+                num = int(val)
+                if num > 127:
+                    raise ValueError(f"Constante fuera de rango (-128..127): {num}")
+                operands.append(("const", num))
+            else:
+                raise ValueError(f"Token inesperado: {typ} '{val}'")
+
+            # ---- operando completo: negaciones, cierres y binario ----
+            while True:
+                while ops and ops[-1] is NEG:
+                    ops.pop()
+                    operands.append(("neg", operands.pop()))
+
+                typ, val = self.tok
+                if typ == "OP":
+                    self.reduce(operands, ops, PRECEDENCE[val])
+                    ops.append(val)
+                    self.eat()
+                    break
+
+                self.reduce(operands, ops, 0)
+                if not ops:
+                    # fin de la expresión
+                    return operands[0]
+
+                top = ops[-1]
+                if typ == "RPAREN" and top is OPEN:
+                    ops.pop()
+                    self.eat()
+                    continue
+
+                if top is not OPEN:
+                    _, name, base = top
+                    nargs = len(operands) - base
+                    if typ == "COMMA" and nargs < FUNC_ARITY[name]:
+                        self.eat()
+                        break
+                    if typ == "RPAREN" and nargs == FUNC_ARITY[name]:
+                        ops.pop()
+                        self.eat()
+                        args = operands[base:]
+                        del operands[base:]
+                        operands.append(("func", name, args))
+                        continue
+                    if nargs < FUNC_ARITY[name]:
+                        raise ValueError(f"Esperaba COMMA, llegó {typ} '{val}'")
+
+                raise ValueError(f"Esperaba RPAREN, llegó {typ} '{val}'")
 
-        if tok.type == "NUMBER":
-            num = int(self.eat("NUMBER").val)
-            if num != 0:
-                raise ValueError("Solo se permite constante 0")
-            return ("const0",)
 
-        raise ValueError(f"Token inesperado: {tok}")
+# ============================================================
+# RECORRIDO DEL AST
+# ============================================================
+
+def children(node):
+    kind = node[0]
+    if kind in ("var", "const", "tmp"):
+        return ()
+    if kind == "neg":
+        return (node[1],)
+    if kind == "func":
+        return node[2]
+    if kind == "binop":
+        return (node[2], node[3])
+    raise ValueError("Nodo AST no reconocido: " + str(node))
+
+
+def walk_tree(node, combine, visit=None):
+    # post-orden con pila explícita: devuelve combine(nodo, resultados de
+    # sus hijos), con los hijos en orden de izquierda a derecha. Si visit
+    # devuelve algo distinto de None para un nodo, ese es su resultado y
+    # no se baja a sus hijos.
+    out = []
+    stack = [(node, False)]
+    while stack:
+        node, ready = stack.pop()
+        if ready:
+            n = len(children(node))
+            args = out[len(out) - n:]
+            del out[len(out) - n:]
+            out.append(combine(node, args))
+            continue
+        if visit is not None:
+            v = visit(node)
+            if v is not None:
+                out.append(v)
+                continue
+        stack.append((node, True))
+        for child in reversed(children(node)):
+            stack.append((child, False))
+    return out[0]
 
 
 # ============================================================
 # AST SIMPLE OPT
 # ============================================================
 
+def is_const(node, val=None):
+    return node[0] == "const" and (val is None or node[1] == val)
+
+
+def is_pow2(c):
+    return c > 0 and c & (c - 1) == 0
+
+
+def fold_binop(op, x, y):
+    # misma semántica que el código generado; lo que en ejecución sería
+    # error se informa ya al compilar
+    if op == "*":
+        if abs(x) * abs(y) > 127:
+            raise ValueError(f"Overflow en tiempo de compilación: {x} * {y}")
+        return x * y
+
+    if op in ("/", "%"):
+        if y == 0:
+            raise ValueError(f"División por cero en tiempo de compilación: {x} {op} {y}")
+        if x < y:
+            q, r = 0, x
+        elif y < 0:
+            raise ValueError(f"Divisor negativo en tiempo de compilación: {x} {op} {y}")
+        else:
+            q, r = divmod(x, y)
+        return q if op == "/" else r
+
+    res = x + y if op == "+" else x - y
+    if res > 127:
+        raise ValueError(f"Overflow en tiempo de compilación: {x} {op} {y}")
+    return res
+
+
+def fold_func(name, xs):
+    if name == "max":
+        return max(xs)
+    if name == "min":
+        return min(xs)
+    return abs(xs[0])
+
+
+def at_most_127(node):
+    # una entrada o el resultado de +, - o * (los que pasan de 127
+    # terminan en error) nunca vale más de 127. / y % no: abs(a)/1 con
+    # a = -128 vale 128
+    return node[0] == "var" or (node[0] == "binop" and node[1] in ("+", "-", "*"))
+
+
 def simplify(node):
+    return walk_tree(node, simplify_node)
+
+
+def simplify_node(node, args):
+    # args: los hijos de node ya simplificados
     kind = node[0]
 
-    if kind in ("var", "const0"):
+    if kind in ("var", "const", "tmp"):
         return node
 
     if kind == "neg":
-        return ("neg", simplify(node[1]))
+        X = args[0]
+        if is_const(X):
+            return ("const", -X[1])
+        if X[0] == "neg":
+            return X[1]
+        return ("neg", X)
 
     if kind == "func":
-        return ("func", node[1], [simplify(a) for a in node[2]])
+        if all(is_const(a) for a in args):
+            return ("const", fold_func(node[1], [a[1] for a in args]))
+        return ("func", node[1], args)
 
     if kind == "binop":
-        op, L, R = node[1], simplify(node[2]), simplify(node[3])
+        op, L, R = node[1], args[0], args[1]
+
+        if is_const(L) and is_const(R):
+            return ("const", fold_binop(op, L[1], R[1]))
 
+        # identidades que no cambian los errores: x*1 y x*-1 fallan con
+        # x = -128 (|x| > 127) y 0-x también, pero neg no tiene chequeo;
+        # x+0 falla si x > 127 (ver at_most_127). La excepción es x*0 -> 0,
+        # que descarta los errores de x
         if op == "*":
-            if L[0] == "const0" or R[0] == "const0":
-                return ("const0",)
+            if is_const(L, 0) or is_const(R, 0):
+                return ("const", 0)
 
         if op == "+":
-            if L[0] == "const0":
+            if is_const(L, 0) and at_most_127(R):
                 return R
-            if R[0] == "const0":
+            if is_const(R, 0) and at_most_127(L):
                 return L
 
         if op == "-":
-            if R[0] == "const0":
+            if is_const(R, 0) and at_most_127(L):
                 return L
-            if L[0] == "const0":
-                return ("neg", R)
 
         return ("binop", op, L, R)
 
     return node
 
 
+# ============================================================
+# TABLA DEL SUPEROPTIMIZADOR
+# ============================================================
+#
+# superopt.py busca offline las secuencias más baratas para subárboles
+# chicos de neg/abs/max/min sobre variables y las guarda en
+# superopt_table.json; build_ir las elige antes que las plantillas de
+# CodeGen.
+
+SUPEROPT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "superopt_table.json")
+SUPEROPT_MAX_OPS = 2
+SUPEROPT_TABLE = None
+
+
+def superopt_table():
+    global SUPEROPT_TABLE
+    if SUPEROPT_TABLE is None:
+        try:
+            with open(SUPEROPT_FILE, encoding="utf-8") as f:
+                SUPEROPT_TABLE = json.load(f)["entries"]
+        except OSError:
+            SUPEROPT_TABLE = {}
+    return SUPEROPT_TABLE
+
+
+def shape_key(node):
+    # ("max(X,neg(Y))", ["a", "b"]) para un subárbol de hasta
+    # SUPEROPT_MAX_OPS operaciones neg/abs/max/min sobre a lo sumo dos
+    # variables (X la primera que aparece, Y la segunda); si no, None
+    leaves = []
+    ops = 0
+
+    def walk(n):
+        nonlocal ops
+        kind = n[0]
+        if kind == "var":
+            if n[1] not in leaves:
+                leaves.append(n[1])
+            return "XY"[leaves.index(n[1])] if len(leaves) <= 2 else None
+        if kind == "neg":
+            args = [n[1]]
+            name = "neg"
+        elif kind == "func":
+            args = n[2]
+            name = n[1]
+        else:
+            return None
+        ops += 1
+        if ops > SUPEROPT_MAX_OPS:
+            return None
+        parts = [walk(a) for a in args]
+        if None in parts:
+            return None
+        return name + "(" + ",".join(parts) + ")"
+
+    key = walk(node)
+    if key is None:
+        return None
+    return key, leaves
+
+
+# ============================================================
+# IR DE TRES DIRECCIONES
+# ============================================================
+#
+# Entre el AST y ASUA: cada operación es una instrucción
+#     %n = op args
+# sobre temporales virtuales. Los operandos son ("tmp", n), ("var",
+# nombre) o ("const", valor). El programa es una sola lista de
+# instrucciones, sin saltos, que termina en ("ret", [(nombre, operando),
+# ...]): guarda las salidas (result, o las de un programa). Los lazos de
+# *, / y % aparecen como bloques básicos recién en el código ASUA (ver
+# machine_blocks).
+
+COMMUTATIVE = ("+", "*", "max", "min")
+
+
+class IRInstr:
+    def __init__(self, op, dst, args, key=None):
+        # op: "+", "-", "*", "/", "%", "neg", "max", "min", "abs", "tmpl",
+        # o "divmod" y "rem" (ver ir_fuse)
+        # key: en "tmpl", la forma de superopt_table.json
+        self.op = op
+        self.dst = dst
+        self.args = args
+        self.key = key
+        # chequeos que pueden fallar (ver ir_ranges); None = todos
+        self.checks = None
+        # en / y %, el mayor valor del dividendo (ver ir_ranges); None = sin
+        # cota conocida
+        self.bound = None
+        # llamar a la subrutina compartida en vez de generarla acá (ir_calls)
+        self.call = False
+
+
+class IRProgram:
+    def __init__(self):
+        self.instrs = []
+        self.term = None
+        self.ntemps = 0
+
+    def new_temp(self):
+        self.ntemps += 1
+        return ("tmp", self.ntemps)
+
+
+# nombres que no pueden ser salidas de un programa: celdas del compilador
+RESERVED_RE = re.compile(r"(t\d+|error|zero|(mul|divmod|div|mod)_\w*)$")
+
+
+def resolve(node, env):
+    # reemplaza las variables ya asignadas por lo que valen (un temporal,
+    # una constante o una entrada)
+    def combine(node, args):
+        kind = node[0]
+        if kind == "var":
+            return env.get(node[1], node)
+        if kind == "neg":
+            return ("neg", args[0])
+        if kind == "func":
+            return ("func", node[1], args)
+        if kind == "binop":
+            return ("binop", node[1], args[0], args[1])
+        return node
+
+    return walk_tree(node, combine)
+
+
+def build_ir(ast, superopt=True, outputs=None):
+    # ast: árbol ya simplificado (va a result), o lista de sentencias
+    # (nombre, árbol) de un programa. En un programa, las sentencias que
+    # siguen a una asignación leen el valor calculado y no la memoria: las
+    # salidas se guardan todas al final. outputs: nombres que se guardan
+    # (por defecto todos los asignados); los demás son intermedios.
+    # Con superopt, los subárboles que tienen secuencia en
+    # superopt_table.json quedan como una sola instrucción
+    prog = IRProgram()
+    table = superopt_table() if superopt else {}
+
+    def template(node):
+        if node[0] not in ("neg", "func"):
+            return None
+        shape = shape_key(node)
+        if shape is None or shape[0] not in table:
+            return None
+        dst = prog.new_temp()
+        prog.instrs.append(IRInstr("tmpl", dst, [("var", v) for v in shape[1]], shape[0]))
+        return dst
+
+    def combine(node, args):
+        kind = node[0]
+        if kind in ("var", "const", "tmp"):
+            return node
+        dst = prog.new_temp()
+        prog.instrs.append(IRInstr("neg" if kind == "neg" else node[1], dst, args))
+        return dst
+
+    if not isinstance(ast, list):
+        prog.term = ("ret", [("result", walk_tree(ast, combine, template))])
+        return prog
+
+    env = {}
+    for name, tree in ast:
+        env[name] = walk_tree(simplify(resolve(tree, env)), combine, template)
+    if outputs is None:
+        outputs = list(env)
+    for name in outputs:
+        if name not in env:
+            raise ValueError(f"Salida sin asignar: {name}")
+        if RESERVED_RE.match(name):
+            raise ValueError(f"Nombre reservado: {name}")
+    prog.term = ("ret", [(name, env[name]) for name in outputs])
+    return prog
+
+
+def format_operand(o):
+    return f"%{o[1]}" if o[0] == "tmp" else str(o[1])
+
+
+def format_ir(prog):
+    lines = []
+    for ins in prog.instrs:
+        op = f"tmpl {ins.key}" if ins.op == "tmpl" else ins.op
+        args = ", ".join(format_operand(a) for a in ins.args)
+        lines.append(f"    {format_operand(ins.dst)} = {op} {args}")
+    outs = ", ".join(f"{name}={format_operand(a)}" for name, a in prog.term[1])
+    lines.append(f"    {prog.term[0]} {outs}")
+    return lines
+
+
+def ir_uses(prog):
+    # temporal -> cantidad de usos
+    uses = {}
+    for ins in prog.instrs:
+        for a in ins.args:
+            if a[0] == "tmp":
+                uses[a] = uses.get(a, 0) + 1
+    for _, a in prog.term[1]:
+        if a[0] == "tmp":
+            uses[a] = uses.get(a, 0) + 1
+    return uses
+
+
+def ir_cse(prog):
+    # numeración de valores: una instrucción igual a una anterior (a*b y
+    # b*a cuentan como iguales) se borra y sus usos pasan al temporal de
+    # la primera. Devuelve cuántas se borraron.
+    seen = {}
+    alias = {}
+    hits = 0
+    kept = []
+    for ins in prog.instrs:
+        ins.args = [alias.get(a, a) for a in ins.args]
+        args = sorted(ins.args) if ins.op in COMMUTATIVE else ins.args
+        key = (ins.op, ins.key, tuple(args))
+        if key in seen:
+            alias[ins.dst] = seen[key]
+            hits += 1
+            continue
+        seen[key] = ins.dst
+        kept.append(ins)
+    prog.instrs = kept
+    op, outs = prog.term
+    prog.term = (op, [(name, alias.get(a, a)) for name, a in outs])
+    return hits
+
+
+def ir_fuse(prog):
+    # x / y y x % y con los mismos operandos: una sola división que deja
+    # los dos resultados. La primera de las dos pasa a ser "divmod" (su
+    # destino es el cociente) y la sigue "rem", que toma el resto que
+    # dejó; la otra se borra. Las potencias de 2 quedan como están: son
+    # shifts. Devuelve cuántos pares se juntaron.
+    fused = 0
+    found = {}
+    for ins in prog.instrs:
+        R = ins.args[-1] if ins.args else None
+        if ins.op in ("/", "%") and not (is_const(R) and is_pow2(R[1])):
+            found.setdefault(tuple(ins.args), {}).setdefault(ins.op, ins)
+    pairs = {}
+    for ops in found.values():
+        if len(ops) == 2:
+            pairs[id(ops["/"])] = pairs[id(ops["%"])] = (ops["/"], ops["%"])
+    if not pairs:
+        return 0
+
+    out = []
+    done = set()
+    for ins in prog.instrs:
+        pair = pairs.get(id(ins))
+        if pair is None:
+            out.append(ins)
+            continue
+        div, mod = pair
+        if id(div) in done:
+            continue
+        done.add(id(div))
+        fused += 1
+        first = IRInstr("divmod", div.dst, div.args)
+        first.bound = div.bound
+        if div.checks is not None and mod.checks is not None:
+            first.checks = div.checks | mod.checks
+        out.append(first)
+        out.append(IRInstr("rem", mod.dst, [div.dst]))
+    prog.instrs = out
+    return fused
+
+
+def ir_order(prog, fixed=False):
+    # orden de evaluación de los operandos (Sethi-Ullman). need es cuántos
+    # registros pide un temporal sin bajar nada a memoria: toda operación
+    # usa A y B, y dos hijos con el mismo need piden uno más. Cuando los
+    # dos operandos se calculan, el primero queda guardado mientras se
+    # calcula el segundo, que termina en A:
+    #  - en +, max y min se evalúa primero el de mayor need y el último
+    #    pasa a ser el izquierdo (ya está en A);
+    #  - en -, *, / y % primero el derecho: el izquierdo queda en A y el
+    #    derecho se lee de memoria directo a B. En * no se cambian los
+    #    operandos de lugar: el lazo da una vuelta por bit del derecho y
+    #    el programador puede haberlo elegido chico;
+    #  - un temporal con varios usos va primero: se guarda igual al
+    #    calcularlo (ver CodeGen.lower), así que esperar no cuesta nada.
+    # Con un solo operando calculado, en las conmutativas ese va a la
+    # izquierda. Con fixed se mantiene el orden de izquierda a derecha y
+    # solo se dan vuelta operandos de conmutativas. Reordena las
+    # instrucciones y devuelve cuántas cambiaron el orden o los operandos.
+    uses = ir_uses(prog)
+    changed = 0
+    defs = {ins.dst: ins for ins in prog.instrs}
+    need = {}
+    for ins in prog.instrs:
+        ns = sorted((need.get(a, 0) for a in ins.args), reverse=True)
+        n = ns[0] + (len(ns) == 2 and ns[0] == ns[1])
+        need[ins.dst] = max(n, 2)
+
+    # raíces: las salidas y lo que no usa nadie (una sentencia que
+    # puede fallar se evalúa aunque no sea salida)
+    roots = [a for _, a in prog.term[1]]
+    roots += [ins.dst for ins in prog.instrs if ins.dst not in uses]
+    out = []
+    seen = set()
+    stack = [(a, False) for a in reversed(roots)]
+    while stack:
+        a, ready = stack.pop()
+        if ready:
+            out.append(defs[a])
+            continue
+        if a not in defs or a in seen:
+            continue
+        seen.add(a)
+        ins = defs[a]
+        order = ins.args
+        if len(order) == 2:
+            l, r = order
+            calc = (l in defs and l not in seen, r in defs and r not in seen)
+            comm = ins.op in COMMUTATIVE and ins.op != "*"
+            if calc == (True, True):
+                if fixed:
+                    right = False
+                elif (uses[l] > 1) != (uses[r] > 1):
+                    right = uses[r] > 1
+                elif comm:
+                    right = need[r] > need[l]
+                else:
+                    right = True
+                order = [r, l] if right else [l, r]
+                if comm:
+                    ins.args = order[::-1]
+                changed += comm or right
+            elif calc == (False, True) and comm:
+                ins.args = [r, l]
+                changed += 1
+        stack.append((a, True))
+        for x in reversed(order):
+            stack.append((x, False))
+    prog.instrs = out
+    return changed
+
+
+# ============================================================
+# RANGOS DE VALORES
+# ============================================================
+#
+# Intervalo [lo, hi] de cada temporal a partir de los rangos de las
+# entradas. Una operación que falla termina el programa, así que el
+# intervalo de su resultado es el de los casos sin error. Con eso se
+# sabe qué chequeos de cada instrucción pueden saltar a la rutina de
+# error:
+#  - "gt": resultado > 127 (+, - y *);
+#  - "lt": resultado < -127 (*);
+#  - "zero": divisor 0 (/ y %);
+#  - "neg": divisor negativo con dividendo >= divisor (/ y %).
+# Además deja en / y % la cota del dividendo, que elige el lazo de la
+# división (ver CodeGen.divmod_body): - no chequea por abajo y neg y abs
+# no chequean, así que un dividendo puede pasar de 8 bits.
+
+INPUT_RANGE = (-128, 127)
+
+CHECKS = {"+": {"gt"}, "-": {"gt"}, "*": {"gt", "lt"}, "/": {"zero", "neg"}, "%": {"zero", "neg"}}
+
+
+def magnitude(r):
+    return max(abs(r[0]), abs(r[1]))
+
+
+def range_op(ins, xs):
+    # (intervalo del resultado, chequeos que pueden fallar)
+    op = ins.op
+    if op == "neg":
+        (lo, hi), = xs
+        return (-hi, -lo), set()
+    if op == "abs":
+        (lo, hi), = xs
+        if lo >= 0:
+            return (lo, hi), set()
+        if hi <= 0:
+            return (-hi, -lo), set()
+        return (0, max(-lo, hi)), set()
+    if op == "tmpl":
+        # solo neg/abs/max/min: no se sale del mayor valor absoluto
+        m = max(magnitude(x) for x in xs)
+        return (-m, m), set()
+    if op in ("max", "min"):
+        f = max if op == "max" else min
+        return (f(xs[0][0], xs[1][0]), f(xs[0][1], xs[1][1])), set()
+
+    (xl, xh), (yl, yh) = xs
+    if op == "+":
+        return (xl + yl, min(xh + yh, 127)), {"gt"} if xh + yh > 127 else set()
+    if op == "-":
+        return (xl - yh, min(xh - yl, 127)), {"gt"} if xh - yl > 127 else set()
+    if op == "*":
+        ps = (xl * yl, xl * yh, xh * yl, xh * yh)
+        lo, hi = min(ps), max(ps)
+        checks = {c for c, bad in (("gt", hi > 127), ("lt", lo < -127)) if bad}
+        return (max(lo, -127), min(hi, 127)), checks
+
+    # / y %: dividendo < divisor da (0, dividendo); si no, divisor > 0
+    checks = set()
+    if yl <= 0 <= yh:
+        checks.add("zero")
+    if yl < 0 and xh >= yl:
+        checks.add("neg")
+    if op == "/":
+        return (0, max(0, xh // max(yl, 1))), checks
+    lo = min(xl, 0)
+    return (lo, max(lo, min(xh, yh - 1))), checks
+
+
+def ir_ranges(prog, inputs=None, checks=True):
+    # inputs: nombre -> (min, max) de las entradas (las demás en
+    # INPUT_RANGE). Anota en cada instrucción sus chequeos necesarios y
+    # devuelve cuántos se pudieron omitir. Con checks=False solo anota las
+    # cotas de los dividendos y los chequeos quedan todos.
+    inputs = inputs or {}
+    for name, (lo, hi) in inputs.items():
+        if lo > hi:
+            raise ValueError(f"Rango vacío para {name}: {lo}..{hi}")
+    ranges = {}
+
+    def range_of(a):
+        if a[0] == "const":
+            return a[1], a[1]
+        if a[0] == "var":
+            return tuple(inputs.get(a[1], INPUT_RANGE))
+        return ranges[a]
+
+    omitted = 0
+    for ins in prog.instrs:
+        xs = [range_of(a) for a in ins.args]
+        ranges[ins.dst], needed = range_op(ins, xs)
+        if ins.op in ("/", "%"):
+            ins.bound = xs[0][1]
+        if checks:
+            ins.checks = needed
+            omitted += len(CHECKS.get(ins.op, set()) - needed)
+    return omitted
+
+
+# ============================================================
+# REPRESENTACIÓN DE INSTRUCCIONES
+# ============================================================
+#
+# Internamente el programa no son líneas de texto: cada instrucción son
+# tres enteros (opcode, destino, fuente) en un array plano, y los nombres
+# de celdas (variables y temporales) y labels van internados en tablas de
+# símbolos. El texto ASUA se arma recién al final (Code.lines) o se
+# escribe directo a un archivo (Code.write).
+
+OPS = ("MOV", "ADD", "SUB", "AND", "SHL", "SHR", "CMP",
+       "JMP", "JEQ", "JNE", "JGT", "JGE", "JLT", "JLE", "CALL", "RET", "HLT", ":")
+OPCODE = {name: i for i, name in enumerate(OPS)}
+OP_MOV = OPCODE["MOV"]
+OP_CMP = OPCODE["CMP"]
+OP_JMP = OPCODE["JMP"]
+OP_CALL = OPCODE["CALL"]
+OP_RET = OPCODE["RET"]
+OP_HLT = OPCODE["HLT"]
+OP_LABEL = OPCODE[":"]
+# saltos (incluye JMP) y CALL: su destino es un label
+OP_JUMPS = frozenset(OPCODE[j] for j in ("JMP", "JEQ", "JNE", "JGT", "JGE", "JLT", "JLE"))
+OP_TARGET = OP_JUMPS | {OP_CALL}
+OP_WRITES = frozenset(OPCODE[o] for o in ("ADD", "SUB", "AND", "SHL", "SHR"))
+
+# operando = valor << 3 | tipo; 0 = sin operando
+K_NONE, K_REG, K_IMM, K_MEM, K_LAB = range(5)
+NO = 0
+
+
+def opnd(kind, val):
+    return val << 3 | kind
+
+
+def kind_of(o):
+    return o & 7
+
+
+def val_of(o):
+    return o >> 3
+
+
+def imm(v):
+    return opnd(K_IMM, v)
+
+
+RA = opnd(K_REG, 0)
+RB = opnd(K_REG, 1)
+REGS = ("A", "B")
+REG = {"A": RA, "B": RB}
+
+
+class Symbols:
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def intern(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+    def name(self, i):
+        return self.names[i]
+
+
+class Code:
+    def __init__(self):
+        self.words = array("i")
+        self.cells = Symbols()
+        self.labels = Symbols()
+
+    def __len__(self):
+        return len(self.words) // 3
+
+    def __getitem__(self, i):
+        w = self.words
+        k = 3 * i
+        return w[k], w[k + 1], w[k + 2]
+
+    def __iter__(self):
+        w = self.words
+        for k in range(0, len(w), 3):
+            yield w[k], w[k + 1], w[k + 2]
+
+    def append(self, op, dst=NO, src=NO):
+        self.words.extend((op, dst, src))
+
+    def window(self, i, n):
+        return [self[j] for j in range(i, min(i + n, len(self)))]
+
+    def replace(self, i, n, instrs):
+        # reemplaza las instrucciones i..i+n-1 por instrs
+        self.words[3 * i:3 * (i + n)] = array("i", [x for ins in instrs for x in ins])
+
+    def set(self, i, op, dst=NO, src=NO):
+        self.words[3 * i:3 * i + 3] = array("i", (op, dst, src))
+
+    def remove(self, drop):
+        # borra de una sola pasada las instrucciones con índice en drop
+        w = self.words
+        self.words = array("i", [x for i in range(len(self)) if i not in drop
+                                 for x in w[3 * i:3 * i + 3]])
+
+    def render_opnd(self, o):
+        kind, v = kind_of(o), val_of(o)
+        if kind == K_REG:
+            return REGS[v]
+        if kind == K_IMM:
+            return str(v)
+        if kind == K_MEM:
+            return f"({self.cells.name(v)})"
+        if kind == K_LAB:
+            return self.labels.name(v)
+        return None
+
+    def render(self, ins):
+        op, dst, src = ins
+        return join_instr(OPS[op], self.render_opnd(dst), self.render_opnd(src))
+
+    def lines(self):
+        return [self.render(ins) for ins in self]
+
+    def write(self, f):
+        for ins in self:
+            f.write(self.render(ins) + "\n")
+
+
 # ============================================================
 # CODE GEN
 # ============================================================
 
+
+class Val:
+    # Valor intermedio: vive en un registro (reg) y/o en memoria (home).
+    # home es una variable, un temporal o un inmediato (int).
+    def __init__(self, home=None):
+        self.home = home
+        self.reg = None
+
+
 class CodeGen:
-    def __init__(self):
-        self.code = []
-        self.reads = 0
-        self.writes = 0
+    def __init__(self, mul=None, div=None):
+        self.mul = mul or MUL_STRATEGY
+        self.div = div or DIV_STRATEGY
+        self.code = Code()
         self.temp_counter = 0
         self.label_counter = 0
+        # valores vivos que hubo que bajar a memoria por falta de registros
+        self.spills = 0
         self.error_label = self.new_label()
         self.end_label = self.new_label()
-
-    def emit(self, line):
-        self.code.append(line)
-
-    def mem_read(self):
-        self.reads += 1
-
-    def mem_write(self):
-        self.writes += 1
+        # qué valor vivo contiene cada registro
+        self.regs = {"A": None, "B": None}
+        # chequeos y cota del dividendo de la instrucción del IR que se
+        # está bajando
+        self.checks = None
+        self.bound = None
+        # subrutinas compartidas: tipo -> [label, chequeos, cota del
+        # dividendo]; mientras se genera una, local es su tipo y sus celdas
+        # no son temporales
+        self.subs = {}
+        self.local = None
+        self.local_counter = 0
+        # cociente de un divmod -> celda con su resto (ver gen_divmod_pair)
+        self.remainders = {}
+
+    def emit(self, op, dst=NO, src=NO):
+        self.code.append(OPCODE[op], dst, src)
+
+    def mem(self, name):
+        return opnd(K_MEM, self.code.cells.intern(name))
 
     def new_temp(self):
+        if self.local is not None:
+            self.local_counter += 1
+            return f"{self.local}_t{self.local_counter}"
         self.temp_counter += 1
         return f"t{self.temp_counter}"
 
     def new_label(self):
         self.label_counter += 1
-        return f"L{self.label_counter}"
+        return opnd(K_LAB, self.code.labels.intern(f"L{self.label_counter}"))
 
     def loadA(self, var):
-        self.emit(f"MOV A,({var})")
-        self.mem_read()
+        self.emit("MOV", RA, self.mem(var))
 
     def loadB(self, var):
-        self.emit(f"MOV B,({var})")
-        self.mem_read()
+        self.emit("MOV", RB, self.mem(var))
 
     def moveA_imm(self, val):
-        self.emit(f"MOV A,{val}")
+        self.emit("MOV", RA, imm(val))
 
     def moveB_imm(self, val):
-        self.emit(f"MOV B,{val}")
+        self.emit("MOV", RB, imm(val))
 
     def storeA(self, var):
-        self.emit(f"MOV ({var}),A")
-        self.mem_write()
+        self.emit("MOV", self.mem(var), RA)
 
     def store_zero(self, var):
         if IMMEDIATE_ZERO:
             self.moveA_imm(0)
         else:
-            self.emit("MOV A,(zero)")
-            self.mem_read()
+            self.emit("MOV", RA, self.mem("zero"))
         self.storeA(var)
 
     # ============================================================
-    # GENERADOR PRINCIPAL DE EXPRESIONES
+    # SEGUIMIENTO DE REGISTROS A/B
     # ============================================================
-    def gen(self, node):
-        kind = node[0]
-
-        # variable
-        if kind == "var":
-            return node[1]
-
-        # constante 0
-        if kind == "const0":
+    def move_imm(self, reg, val):
+        if val == 0 and not IMMEDIATE_ZERO:
+            self.emit("MOV", REG[reg], self.mem("zero"))
+        else:
+            self.emit("MOV", REG[reg], imm(val))
+
+    def result_in(self, reg):
+        v = Val()
+        v.reg = reg
+        self.regs[reg] = v
+        return v
+
+    def release(self, v):
+        # v ya fue consumido: su registro deja de estar vivo
+        if v.reg is not None and self.regs[v.reg] is v:
+            self.regs[v.reg] = None
+        v.reg = None
+
+    def spill(self, reg):
+        v = self.regs[reg]
+        if v.home is None:
             t = self.new_temp()
-            self.store_zero(t)
-            return t
+            self.emit("MOV", self.mem(t), REG[reg])
+            self.spills += 1
+            v.home = t
+        v.reg = None
+        self.regs[reg] = None
+
+    def free(self, reg):
+        # antes de pisar reg: su valor pasa al otro registro si está
+        # libre; solo se baja a memoria si ambos están vivos
+        v = self.regs[reg]
+        if v is None:
+            return
+        other = "B" if reg == "A" else "A"
+        if self.regs[other] is None:
+            self.emit("MOV", REG[other], REG[reg])
+            self.regs[reg] = None
+            self.regs[other] = v
+            v.reg = other
+        else:
+            self.spill(reg)
+
+    def flush(self):
+        for reg in REGS:
+            if self.regs[reg] is not None:
+                self.spill(reg)
+
+    def load(self, reg, v):
+        if v.reg == reg:
+            return
+        self.free(reg)
+        if v.reg is not None:
+            self.emit("MOV", REG[reg], REG[v.reg])
+            self.regs[v.reg] = None
+        elif isinstance(v.home, int):
+            self.move_imm(reg, v.home)
+        else:
+            self.emit("MOV", REG[reg], self.mem(v.home))
+        v.reg = reg
+        self.regs[reg] = v
+
+    def load_pair(self, l, r):
+        # deja l en A y r en B
+        self.load("A", l)
+        if r is l:
+            self.emit("MOV", RB, RA)
+            return
+        self.load("B", r)
+
+    def store_val(self, v, var):
+        self.load("A", v)
+        self.release(v)
+        self.storeA(var)
 
-        # negación
-        if kind == "neg":
-            loc = self.gen(node[1])
-            t = self.new_temp()
-            self.store_zero(t)
-            self.loadA(t)
-            self.loadB(loc)
-            self.emit("SUB A,B")
-            self.storeA(t)
-            return t
+    # ============================================================
+    # BAJADA DEL IR
+    # ============================================================
+    def lower(self, prog, fragment=False):
+        # cada instrucción del IR con las plantillas gen_*; un temporal con
+        # más de un uso se guarda en memoria al calcularlo y los usos que
+        # siguen al primero lo leen de ahí. Con fragment, el código es un
+        # pedazo para enlazar con otros (ver incremental.py): al terminar
+        # sigue de largo y los errores terminan en un HLT
+        uses = ir_uses(prog)
+        vals = {}
+        taken = set()
+
+        def val(a):
+            if a[0] != "tmp":
+                return Val(a[1])
+            v = vals[a]
+            if a in taken:
+                return Val(v.home)
+            taken.add(a)
+            return v
+
+        for ins in prog.instrs:
+            # rem no consume el cociente, solo lo nombra (ver ir_fuse)
+            args = [] if ins.op == "rem" else [val(a) for a in ins.args]
+            v = self.gen_instr(ins, args)
+            if uses.get(ins.dst, 0) > 1 and v.home is None:
+                t = self.new_temp()
+                self.emit("MOV", self.mem(t), REG[v.reg])
+                v.home = t
+            elif ins.dst not in uses:
+                # sentencia que no es salida: solo importaba su error
+                self.release(v)
+            vals[ins.dst] = v
+
+        # una salida que vale lo que tenía otra salida (b = a con a
+        # también asignada) se copia antes de que se pise
+        outs = prog.term[1]
+        names = {name for name, _ in outs}
+        finals = []
+        for name, a in outs:
+            if a[0] == "var" and a[1] in names:
+                t = self.new_temp()
+                self.store_val(Val(a[1]), t)
+                finals.append((name, Val(t)))
+            else:
+                finals.append((name, val(a)))
+        for name, final in finals:
+            self.load("A", final)
+            self.release(final)
+            self.storeA(name)
+        self.emit("JMP", self.end_label)
+
+        if fragment:
+            self.emit(":", self.error_label)
+            self.emit("HLT")
+            self.emit(":", self.end_label)
+            return self.code
+
+        # RUTINA ERROR FINAL (overflow / div0): las salidas quedan en 0
+        self.emit(":", self.error_label)
+        self.moveA_imm(1)
+        self.storeA("error")
+        self.moveA_imm(0)
+        for name, _ in prog.term[1]:
+            self.storeA(name)
+        self.emit("JMP", self.end_label)
+
+        self.emit(":", self.end_label)
+        self.emit("HLT")
+
+        # SUBRUTINAS COMPARTIDAS (modo tamaño)
+        for kind, (label, checks, bound) in self.subs.items():
+            self.emit(":", label)
+            self.gen_subroutine(kind, checks, bound)
+        return self.code
+
+    def need(self, check):
+        # el chequeo puede fallar (sin análisis de rangos, siempre)
+        return self.checks is None or check in self.checks
+
+    def gen_instr(self, ins, args):
+        op = ins.op
+        self.checks = ins.checks
+        self.bound = ins.bound
+
+        # subárbol chico con secuencia óptima precalculada
+        if op == "tmpl":
+            return self.gen_template(ins.key, [a[1] for a in ins.args])
+
+        # el resto que dejó el divmod de su cociente
+        if op == "rem":
+            return Val(self.remainders.pop(ins.args[0]))
+
+        # negación: 0 - x
+        if op == "neg":
+            v = args[0]
+            self.load("B", v)
+            self.free("A")
+            self.move_imm("A", 0)
+            self.release(v)
+            self.emit("SUB", RA, RB)
+            return self.result_in("A")
 
         # funciones
-        if kind == "func":
-            fname = node[1]
-            args = node[2]
-
-            if fname == "max":
-                return self.gen_max(args[0], args[1])
-            if fname == "min":
-                return self.gen_min(args[0], args[1])
-            if fname == "abs":
-                return self.gen_abs(args[0])
-
-            raise ValueError("Función no soportada: " + fname)
+        if op == "max":
+            return self.gen_max(args[0], args[1])
+        if op == "min":
+            return self.gen_min(args[0], args[1])
+        if op == "abs":
+            return self.gen_abs(args[0])
 
         # operaciones binarias
-        if kind == "binop":
-            op, L, R = node[1], node[2], node[3]
+        L, R = ins.args
+        l, r = args
 
-            if op == "+":
-                return self.gen_add(L, R)
-            if op == "-":
-                return self.gen_sub(L, R)
-            if op == "*":
-                return self.gen_mul(self.gen(L), self.gen(R))
-            if op == "/":
-                return self.gen_div(self.gen(L), self.gen(R))
-            if op == "%":
-                return self.gen_mod(self.gen(L), self.gen(R))
+        if op == "divmod":
+            return self.gen_divmod_pair(ins, l, r)
 
-            raise ValueError("Operador no soportado: " + op)
+        if ins.call:
+            return self.gen_call(sub_kind(ins, self.div), op, l, r)
 
-        raise ValueError("Nodo AST no reconocido: " + str(node))
+        if op == "+":
+            return self.gen_add(l, r)
+        if op == "-":
+            return self.gen_sub(l, r)
+        if op == "*":
+            if is_const(L):
+                L, R, l, r = R, L, r, l
+            if is_const(R):
+                return self.gen_mul_const(l, R[1])
+            return self.gen_mul(l, r)
+        if op == "/":
+            if is_const(R) and is_pow2(R[1]):
+                return self.gen_div_pow2(l, R[1])
+            return self.gen_div(l, r)
+        if op == "%":
+            if is_const(R) and is_pow2(R[1]):
+                return self.gen_mod_pow2(l, R[1])
+            return self.gen_mod(l, r)
+
+        raise ValueError("Operador no soportado: " + op)
+
+    # secuencia de la tabla: (X)/(Y) son las variables y @n labels locales;
+    # deja el resultado en A y pisa B
+    def gen_template(self, key, leaves):
+        self.flush()
+        names = dict(zip(("(X)", "(Y)"), (f"({v})" for v in leaves)))
+        labels = {}
+        for line in superopt_table()[key]["code"]:
+            op, dst, src = split_instr(line)
+            if op == ":" or op in JUMPS:
+                if dst not in labels:
+                    labels[dst] = self.new_label()
+                self.emit(op, labels[dst])
+                continue
+            src = names.get(src, src)
+            self.emit(op, self.operand(dst), self.operand(src))
+        return self.result_in("A")
+
+    def operand(self, text):
+        # operando de texto ("A", "(x)", "5") -> codificado
+        if text in REG:
+            return REG[text]
+        if is_mem(text):
+            return self.mem(text[1:-1])
+        return imm(int(text))
 
     # ============================================================
     # SUMA CON OVERFLOW
     # ============================================================
-    def gen_add(self, L, R):
-        l = self.gen(L)
-        r = self.gen(R)
-
-        t = self.new_temp()
-        self.loadA(l)
-        self.loadB(r)
-        self.emit("ADD A,B")
+    def gen_add(self, l, r):
+        self.load_pair(l, r)
+        self.release(l)
+        self.release(r)
+        self.emit("ADD", RA, RB)
 
         # overflow +127
-        self.emit("CMP A,127")
-        self.emit(f"JGT {self.error_label}")
+        if self.need("gt"):
+            self.emit("CMP", RA, imm(127))
+            self.emit("JGT", self.error_label)
 
-        self.storeA(t)
-        return t
+        return self.result_in("A")
 
     # ============================================================
     # RESTA CON OVERFLOW
     # ============================================================
-    def gen_sub(self, L, R):
-        l = self.gen(L)
-        r = self.gen(R)
-
-        t = self.new_temp()
-        self.loadA(l)
-        self.loadB(r)
-        self.emit("SUB A,B")
+    def gen_sub(self, l, r):
+        self.load_pair(l, r)
+        self.release(l)
+        self.release(r)
+        self.emit("SUB", RA, RB)
 
         # overflow positivo
-        self.emit("CMP A,127")
-        self.emit(f"JGT {self.error_label}")
+        if self.need("gt"):
+            self.emit("CMP", RA, imm(127))
+            self.emit("JGT", self.error_label)
 
-        self.storeA(t)
-        return t
+        return self.result_in("A")
 
 
     # ============================================================
@@ -319,14 +1279,19 @@ class CodeGen:
     # ============================================================
 
     def gen_mul(self, l, r):
-        self.loadA(l)
         t_a = self.new_temp()
-        self.storeA(t_a)
+        self.store_val(l, t_a)
 
-        self.loadA(r)
         t_b = self.new_temp()
-        self.storeA(t_b)
+        self.store_val(r, t_b)
+
+        # el loop pisa A y B
+        self.flush()
+        self.mul_body(t_a, t_b)
+        return self.result_in("A")
 
+    # a*b con a y b en memoria (las pisa); deja el producto en A
+    def mul_body(self, t_a, t_b):
         # signo
         t_sign = self.new_temp()
         self.store_zero(t_sign)
@@ -336,29 +1301,29 @@ class CodeGen:
         La_end = self.new_label()
 
         self.loadA(t_a)
-        self.emit("CMP A,0")
-        self.emit(f"JGE {La_pos}")
+        self.emit("CMP", RA, imm(0))
+        self.emit("JGE", La_pos)
 
         self.moveA_imm(1)
         self.storeA(t_sign)
 
         self.loadA(t_a)
-        self.emit("MOV B,A")
+        self.emit("MOV", RB, RA)
         self.moveA_imm(0)
-        self.emit("SUB A,B")
+        self.emit("SUB", RA, RB)
         self.storeA(t_a)
-        self.emit(f"JMP {La_end}")
+        self.emit("JMP", La_end)
 
-        self.emit(f"{La_pos}:")
-        self.emit(f"{La_end}:")
+        self.emit(":", La_pos)
+        self.emit(":", La_end)
 
         # abs(b)
         Lb_pos = self.new_label()
         Lb_end = self.new_label()
 
         self.loadA(t_b)
-        self.emit("CMP A,0")
-        self.emit(f"JGE {Lb_pos}")
+        self.emit("CMP", RA, imm(0))
+        self.emit("JGE", Lb_pos)
 
         tmp = self.new_temp()
         self.loadA(t_sign)
@@ -366,23 +1331,67 @@ class CodeGen:
 
         self.moveA_imm(1)
         self.loadB(tmp)
-        self.emit("SUB A,B")
+        self.emit("SUB", RA, RB)
         self.storeA(t_sign)
 
         self.loadA(t_b)
-        self.emit("MOV B,A")
+        self.emit("MOV", RB, RA)
         self.moveA_imm(0)
-        self.emit("SUB A,B")
+        self.emit("SUB", RA, RB)
         self.storeA(t_b)
-        self.emit(f"JMP {Lb_end}")
+        self.emit("JMP", Lb_end)
 
-        self.emit(f"{Lb_pos}:")
-        self.emit(f"{Lb_end}:")
+        self.emit(":", Lb_pos)
+        self.emit(":", Lb_end)
 
-        # multiplicar positivos
+        # multiplicar positivos; si |a*b| <= 127 seguro, sin chequeos
         t_acc = self.new_temp()
         self.store_zero(t_acc)
+        check = self.need("gt") or self.need("lt")
+
+        if self.mul == "shift":
+            self.mul_shift_add(t_a, t_b, t_acc, check)
+        elif self.mul == "min":
+            self.mul_swap_min(t_a, t_b)
+            self.mul_repeat_add(t_a, t_b, t_acc, check)
+        elif self.mul == "add":
+            self.mul_repeat_add(t_a, t_b, t_acc, check)
+        else:
+            raise ValueError("Estrategia de multiplicación no soportada: " + self.mul)
 
+        t_pos = self.new_temp()
+        self.loadA(t_acc)
+        self.storeA(t_pos)
+
+        # aplicar signo
+        Lpos = self.new_label()
+        Lend = self.new_label()
+
+        self.loadA(t_sign)
+        self.emit("CMP", RA, imm(0))
+        self.emit("JEQ", Lpos)
+
+        # negativo: -pos
+        self.loadA(t_pos)
+        self.emit("MOV", RB, RA)
+        self.moveA_imm(0)
+        self.emit("SUB", RA, RB)
+
+        # aquí NO hacer check A<128
+        # solo overflow positivo
+        if check:
+            self.emit("CMP", RA, imm(127))
+            self.emit("JGT", self.error_label)
+        self.emit("JMP", Lend)
+
+        self.emit(":", Lpos)
+        self.loadA(t_pos)
+
+        # ambas ramas dejan el producto en A
+        self.emit(":", Lend)
+
+    # acc += a, b veces (O(b) vueltas)
+    def mul_repeat_add(self, t_a, t_b, t_acc, check=True):
         t_n = self.new_temp()
         self.loadA(t_b)
         self.storeA(t_n)
@@ -390,83 +1399,360 @@ class CodeGen:
         Lloop = self.new_label()
         Ldone = self.new_label()
 
-        self.emit(f"{Lloop}:")
+        self.emit(":", Lloop)
         self.loadA(t_n)
-        self.emit("CMP A,0")
-        self.emit(f"JEQ {Ldone}")
+        self.emit("CMP", RA, imm(0))
+        self.emit("JEQ", Ldone)
 
         self.loadA(t_acc)
         self.loadB(t_a)
-        self.emit("ADD A,B")
+        self.emit("ADD", RA, RB)
 
         # overflow positivo
-        self.emit("CMP A,127")
-        self.emit(f"JGT {self.error_label}")
+        if check:
+            self.emit("CMP", RA, imm(127))
+            self.emit("JGT", self.error_label)
 
         self.storeA(t_acc)
 
         self.loadA(t_n)
         self.moveB_imm(1)
-        self.emit("SUB A,B")
+        self.emit("SUB", RA, RB)
         self.storeA(t_n)
 
-        self.emit(f"JMP {Lloop}")
+        self.emit("JMP", Lloop)
+
+        self.emit(":", Ldone)
+
+    # deja en t_b el menor de los dos (el que cuenta las vueltas)
+    def mul_swap_min(self, t_a, t_b):
+        Lok = self.new_label()
+
+        self.loadA(t_a)
+        self.loadB(t_b)
+        self.emit("CMP", RA, RB)
+        self.emit("JGE", Lok)
+        self.emit("MOV", self.mem(t_b), RA)
+        self.emit("MOV", RA, RB)
+        self.storeA(t_a)
+
+        self.emit(":", Lok)
+
+    # shift-and-add: a lo sumo 7 vueltas para |b| <= 127
+    def mul_shift_add(self, t_a, t_b, t_acc, check=True):
+        t_n = self.new_temp()
+        self.loadA(t_b)
+        self.storeA(t_n)
+
+        Lloop = self.new_label()
+        Lskip = self.new_label()
+        Ldone = self.new_label()
+
+        self.emit(":", Lloop)
+        # bit bajo de n
+        self.loadA(t_n)
+        self.moveB_imm(1)
+        self.emit("AND", RA, RB)
+        self.emit("CMP", RA, imm(0))
+        self.emit("JEQ", Lskip)
 
-        self.emit(f"{Ldone}:")
-        t_pos = self.new_temp()
         self.loadA(t_acc)
-        self.storeA(t_pos)
+        self.loadB(t_a)
+        self.emit("ADD", RA, RB)
 
-        # aplicar signo
-        Lpos = self.new_label()
+        # overflow positivo
+        if check:
+            self.emit("CMP", RA, imm(127))
+            self.emit("JGT", self.error_label)
+
+        self.storeA(t_acc)
+
+        self.emit(":", Lskip)
+        self.loadA(t_n)
+        self.emit("SHR", RA, RA)
+        self.storeA(t_n)
+        self.emit("CMP", RA, imm(0))
+        self.emit("JEQ", Ldone)
+
+        # quedan bits: si a*2 ya pasa 127 el producto también
+        self.loadA(t_a)
+        self.emit("SHL", RA, RA)
+        if check:
+            self.emit("CMP", RA, imm(127))
+            self.emit("JGT", self.error_label)
+        self.storeA(t_a)
+
+        self.emit("JMP", Lloop)
+
+        self.emit(":", Ldone)
+
+    # ============================================================
+    # OPERACIONES CON CONSTANTE (SHIFTS, SUMAS Y MÁSCARAS)
+    # ============================================================
+
+    # x*c sin loop: Horner sobre los bits de |c| con x fijo en B
+    def gen_mul_const(self, v, c):
+        if c == 0:
+            self.release(v)
+            return Val(0)
+
+        bits = bin(abs(c))[3:]
+        self.load("A", v)
+        # B se pisa con x o al negar: se libera ahora, con v todavía en A,
+        # para que lo vivo en B vaya a memoria (con A libre, free lo
+        # movería a A y el producto lo pisaría)
+        if "1" in bits or c < 0:
+            self.free("B")
+        if "1" in bits:
+            self.emit("MOV", RB, RA)
+        self.release(v)
+
+        for bit in bits:
+            self.emit("SHL", RA, RA)
+            if bit == "1":
+                self.emit("ADD", RA, RB)
+
+        if c < 0:
+            self.emit("MOV", RB, RA)
+            self.moveA_imm(0)
+            self.emit("SUB", RA, RB)
+
+        # overflow: |x*c| > 127
+        if self.need("gt"):
+            self.emit("CMP", RA, imm(127))
+            self.emit("JGT", self.error_label)
+        if self.need("lt"):
+            self.emit("CMP", RA, imm(-127))
+            self.emit("JLT", self.error_label)
+        return self.result_in("A")
+
+    # x / 2^k: dividendo negativo (< divisor) da 0, si no x >> k
+    def gen_div_pow2(self, v, c):
+        Lneg = self.new_label()
         Lend = self.new_label()
 
-        self.loadA(t_sign)
-        self.emit("CMP A,0")
-        self.emit(f"JEQ {Lpos}")
+        self.load("A", v)
+        self.release(v)
+        self.emit("CMP", RA, imm(0))
+        self.emit("JLT", Lneg)
+        for _ in range(c.bit_length() - 1):
+            self.emit("SHR", RA, RA)
+        self.emit("JMP", Lend)
 
-        # negativo: -pos
-        self.loadA(t_pos)
-        self.emit("MOV B,A")
+        self.emit(":", Lneg)
         self.moveA_imm(0)
-        self.emit("SUB A,B")
 
-        # aquí NO hacer check A<128
-        # solo overflow positivo
-        self.emit("CMP A,127")
-        self.emit(f"JGT {self.error_label}")
+        self.emit(":", Lend)
+        return self.result_in("A")
 
-        t_final = self.new_temp()
-        self.storeA(t_final)
-        self.emit(f"JMP {Lend}")
+    # x % 2^k: dividendo negativo queda igual, si no x & (2^k - 1)
+    def gen_mod_pow2(self, v, c):
+        Lend = self.new_label()
 
-        self.emit(f"{Lpos}:")
-        t_final = self.new_temp()
-        self.loadA(t_pos)
-        self.storeA(t_final)
+        self.load("A", v)
+        self.free("B")
+        self.release(v)
+        self.emit("CMP", RA, imm(0))
+        self.emit("JLT", Lend)
+        self.moveB_imm(c - 1)
+        self.emit("AND", RA, RB)
 
-        self.emit(f"{Lend}:")
-        return t_final
+        self.emit(":", Lend)
+        return self.result_in("A")
+
+    # ============================================================
+    # DIVISIÓN BINARIA: COCIENTE Y RESTO JUNTOS
+    # ============================================================
+
+    # Devuelve las celdas (cociente, resto). Mantiene lo que hacía la
+    # resta repetida: divisor 0 -> error, dividendo < divisor -> (0,
+    # dividendo). Con divisor negativo aquel loop no terminaba: ahora es
+    # error. Para dividendo >= divisor > 0 hace división con restauración,
+    # un paso por bit del dividendo: los bits salen por izquierda hacia el
+    # resto y entran los del cociente por derecha. Los pasos salen de la
+    # cota del dividendo (ir_ranges), 8 si entra en 8 bits; sin cota (un
+    # hueco de un fragmento) vuelve a la resta repetida.
+    def gen_divmod(self, l, r):
+        # divisor constante positivo: sobran los chequeos de 0 y de signo
+        known = r.home if isinstance(r.home, int) else None
+        t_n = self.new_temp()   # dividendo; al terminar, cociente
+        t_d = self.new_temp()
+        t_r = self.new_temp()
+
+        self.store_val(l, t_n)
+        self.store_val(r, t_d)
+        self.flush()
+        self.divmod_body(t_n, t_d, t_r, known)
+        return t_n, t_r
+
+    # dividendo en t_n y divisor en t_d; deja el cociente en t_n y el
+    # resto en t_r
+    def divmod_body(self, t_n, t_d, t_r, known=None):
+        bits = None if self.bound is None else max(8, self.bound.bit_length())
+
+        Lsmall = self.new_label()
+        Lloop = self.new_label()
+        Lzero = self.new_label()
+        Lshift = self.new_label()
+        Lno = self.new_label()
+        Lnext = self.new_label()
+        Lend = self.new_label()
+
+        self.loadA(t_d)
+        if self.need("zero") and (known is None or known <= 0):
+            self.emit("CMP", RA, imm(0))
+            self.emit("JEQ", self.error_label)
+
+        self.emit("MOV", RB, RA)
+        self.loadA(t_n)
+        self.emit("CMP", RA, RB)
+        self.emit("JLT", Lsmall)
+
+        if self.need("neg") and (known is None or known < 0):
+            self.emit("MOV", RA, RB)
+            self.emit("CMP", RA, imm(0))
+            self.emit("JLT", self.error_label)
+
+        if bits is None:
+            # r = n ; q = 0 ; mientras r >= d: r -= d, q += 1
+            self.loadA(t_n)
+            self.storeA(t_r)
+            self.store_zero(t_n)
+            self.emit(":", Lloop)
+            self.loadA(t_r)
+            self.loadB(t_d)
+            self.emit("SUB", RA, RB)
+            self.storeA(t_r)
+            self.loadA(t_n)
+            self.moveB_imm(1)
+            self.emit("ADD", RA, RB)
+            self.storeA(t_n)
+            self.loadA(t_r)
+            self.loadB(t_d)
+            self.emit("CMP", RA, RB)
+            self.emit("JGE", Lloop)
+            self.emit("JMP", Lend)
+        else:
+            # bits pasos: n < 2**bits por la cota
+            t_c = self.new_temp()
+            top = 1 << (bits - 1)
+            self.store_zero(t_r)
+            self.moveA_imm(bits)
+            self.storeA(t_c)
+
+            self.emit(":", Lloop)
+            # r = r*2 + bit alto de n ; n = n*2
+            self.loadA(t_n)
+            self.emit("CMP", RA, imm(top))
+            self.emit("JLT", Lzero)
+
+            self.moveB_imm(top)
+            self.emit("SUB", RA, RB)
+            self.emit("SHL", RA, RA)
+            self.storeA(t_n)
+            self.loadA(t_r)
+            self.emit("SHL", RA, RA)
+            self.moveB_imm(1)
+            self.emit("ADD", RA, RB)
+            self.emit("JMP", Lshift)
+
+            self.emit(":", Lzero)
+            self.emit("SHL", RA, RA)
+            self.storeA(t_n)
+            self.loadA(t_r)
+            self.emit("SHL", RA, RA)
+
+            # si r >= d: r -= d y el bit del cociente es 1
+            self.emit(":", Lshift)
+            self.loadB(t_d)
+            self.emit("CMP", RA, RB)
+            self.emit("JLT", Lno)
+
+            self.emit("SUB", RA, RB)
+            self.storeA(t_r)
+            self.loadA(t_n)
+            self.moveB_imm(1)
+            self.emit("ADD", RA, RB)
+            self.storeA(t_n)
+            self.emit("JMP", Lnext)
+
+            self.emit(":", Lno)
+            self.storeA(t_r)
+
+            self.emit(":", Lnext)
+            self.loadA(t_c)
+            self.moveB_imm(1)
+            self.emit("SUB", RA, RB)
+            self.storeA(t_c)
+            self.emit("CMP", RA, imm(0))
+            self.emit("JGT", Lloop)
+            self.emit("JMP", Lend)
+
+        # dividendo < divisor: A sigue teniendo el dividendo
+        self.emit(":", Lsmall)
+        self.storeA(t_r)
+        self.store_zero(t_n)
+
+        self.emit(":", Lend)
+
+    # cociente y resto de una sola división (ir_fuse): el cociente queda
+    # en A (y en memoria) y el resto en una celda para la instrucción rem
+    def gen_divmod_pair(self, ins, l, r):
+        if ins.call:
+            kind = sub_kind(ins, self.div)
+            v = self.gen_call(kind, "/", l, r)
+            # la celda de la subrutina se pisa en la próxima llamada
+            t_r = self.new_temp()
+            self.emit("MOV", RB, self.mem("divmod_r" if kind == "divmod" else "div_a"))
+            self.emit("MOV", self.mem(t_r), RB)
+        elif self.div == "binary":
+            t_q, t_r = self.gen_divmod(l, r)
+            self.loadA(t_q)
+            v = self.result_in("A")
+            v.home = t_q
+        elif self.div == "repeat":
+            # al terminar el lazo, el dividendo es el resto
+            t_r = self.new_temp()
+            divisor = self.new_temp()
+            self.store_val(l, t_r)
+            self.store_val(r, divisor)
+            self.flush()
+            self.div_repeat(t_r, divisor)
+            v = self.result_in("A")
+        else:
+            raise ValueError("Estrategia de división no soportada: " + self.div)
+        self.remainders[ins.dst] = t_r
+        return v
 
     # ============================================================
     # DIV, MOD, MAX, MIN, ABS
-    # (NO CAMBIADOS)
     # ============================================================
 
     def gen_div(self, l, r):
+        if self.div == "binary":
+            q, _ = self.gen_divmod(l, r)
+            self.loadA(q)
+            return self.result_in("A")
+        if self.div != "repeat":
+            raise ValueError("Estrategia de división no soportada: " + self.div)
+
         dividend = self.new_temp()
         divisor = self.new_temp()
-        q = self.new_temp()
-        res = self.new_temp()
 
-        self.loadA(l)
-        self.storeA(dividend)
-        self.loadA(r)
-        self.storeA(divisor)
+        self.store_val(l, dividend)
+        self.store_val(r, divisor)
+        self.flush()
+        self.div_repeat(dividend, divisor)
+        return self.result_in("A")
 
-        self.loadA(divisor)
-        self.emit("CMP A,0")
-        self.emit(f"JEQ {self.error_label}")
+    # resta repetida; deja el cociente en A
+    def div_repeat(self, dividend, divisor):
+        q = self.new_temp()
+
+        if self.need("zero"):
+            self.loadA(divisor)
+            self.emit("CMP", RA, imm(0))
+            self.emit("JEQ", self.error_label)
 
         self.store_zero(q)
 
@@ -474,167 +1760,1279 @@ class CodeGen:
         Lbody = self.new_label()
         Lend = self.new_label()
 
-        self.emit(f"{Lstart}:")
+        self.emit(":", Lstart)
         self.loadA(divisor)
         self.loadB(dividend)
-        self.emit("CMP A,B")
-        self.emit(f"JLE {Lbody}")
-        self.emit(f"JMP {Lend}")
+        self.emit("CMP", RA, RB)
+        self.emit("JLE", Lbody)
+        self.emit("JMP", Lend)
 
-        self.emit(f"{Lbody}:")
+        self.emit(":", Lbody)
         self.loadA(dividend)
         self.loadB(divisor)
-        self.emit("SUB A,B")
+        self.emit("SUB", RA, RB)
         self.storeA(dividend)
 
         self.loadA(q)
         self.moveB_imm(1)
-        self.emit("ADD A,B")
+        self.emit("ADD", RA, RB)
         self.storeA(q)
 
-        self.emit(f"JMP {Lstart}")
+        self.emit("JMP", Lstart)
 
-        self.emit(f"{Lend}:")
+        self.emit(":", Lend)
         self.loadA(q)
-        self.storeA(res)
-        return res
 
     def gen_mod(self, l, r):
+        if self.div == "binary":
+            _, rem = self.gen_divmod(l, r)
+            self.loadA(rem)
+            return self.result_in("A")
+        if self.div != "repeat":
+            raise ValueError("Estrategia de división no soportada: " + self.div)
+
         dividend = self.new_temp()
         divisor = self.new_temp()
-        res = self.new_temp()
 
-        self.loadA(l)
-        self.storeA(dividend)
-        self.loadA(r)
-        self.storeA(divisor)
+        self.store_val(l, dividend)
+        self.store_val(r, divisor)
+        self.flush()
+        self.mod_repeat(dividend, divisor)
+        return self.result_in("A")
 
-        self.loadA(divisor)
-        self.emit("CMP A,0")
-        self.emit(f"JEQ {self.error_label}")
+    # resta repetida; deja el resto en A
+    def mod_repeat(self, dividend, divisor):
+        if self.need("zero"):
+            self.loadA(divisor)
+            self.emit("CMP", RA, imm(0))
+            self.emit("JEQ", self.error_label)
 
         Lstart = self.new_label()
         Lbody = self.new_label()
         Lend = self.new_label()
 
-        self.emit(f"{Lstart}:")
+        self.emit(":", Lstart)
         self.loadA(divisor)
         self.loadB(dividend)
-        self.emit("CMP A,B")
-        self.emit(f"JLE {Lbody}")
-        self.emit(f"JMP {Lend}")
+        self.emit("CMP", RA, RB)
+        self.emit("JLE", Lbody)
+        self.emit("JMP", Lend)
 
-        self.emit(f"{Lbody}:")
+        self.emit(":", Lbody)
         self.loadA(dividend)
         self.loadB(divisor)
-        self.emit("SUB A,B")
+        self.emit("SUB", RA, RB)
         self.storeA(dividend)
-        self.emit(f"JMP {Lstart}")
+        self.emit("JMP", Lstart)
 
-        self.emit(f"{Lend}:")
+        self.emit(":", Lend)
         self.loadA(dividend)
-        self.storeA(res)
-        return res
 
-    def gen_max(self, X, Y):
-        a = self.gen(X)
-        b = self.gen(Y)
-        t = self.new_temp()
+    # ============================================================
+    # SUBRUTINAS COMPARTIDAS
+    # ============================================================
+    #
+    # Argumentos en las celdas (tipo_a) y (tipo_b). La subrutina deja el
+    # resultado en A, salvo divmod: cociente en (divmod_a) y resto en
+    # (divmod_r). Pisa A, B y sus propias celdas, nunca temporales.
+
+    def subroutine(self, kind):
+        # label de la subrutina; junta los chequeos y las cotas de los
+        # dividendos de los que la llaman
+        if kind not in self.subs:
+            self.subs[kind] = [self.new_label(), set(), 0]
+        sub = self.subs[kind]
+        if sub[1] is not None:
+            sub[1] = None if self.checks is None else sub[1] | self.checks
+        if sub[2] is not None:
+            sub[2] = None if self.bound is None else max(sub[2], self.bound)
+        return sub[0]
+
+    def gen_call(self, kind, op, l, r):
+        a, b = f"{kind}_a", f"{kind}_b"
+        self.store_val(l, a)
+        self.store_val(r, b)
+        self.flush()
+        self.emit("CALL", self.subroutine(kind))
+        if kind == "divmod":
+            self.loadA(a if op == "/" else "divmod_r")
+        return self.result_in("A")
+
+    def gen_subroutine(self, kind, checks, bound=None):
+        self.checks = checks
+        self.bound = bound
+        self.local = kind
+        a, b = f"{kind}_a", f"{kind}_b"
+        if kind == "mul":
+            self.mul_body(a, b)
+        elif kind == "divmod":
+            self.divmod_body(a, b, "divmod_r")
+        elif kind == "div":
+            self.div_repeat(a, b)
+        else:
+            self.mod_repeat(a, b)
+        self.emit("RET")
+        self.local = None
+
+    def gen_max(self, a, b):
         Ldone = self.new_label()
 
-        self.loadA(a)
-        self.loadB(b)
-        self.emit("CMP A,B")
-        self.emit(f"JGE {Ldone}")
-        self.loadA(b)
+        self.load_pair(a, b)
+        self.release(a)
+        self.release(b)
+        self.emit("CMP", RA, RB)
+        self.emit("JGE", Ldone)
+        self.emit("MOV", RA, RB)
 
-        self.emit(f"{Ldone}:")
-        self.storeA(t)
-        return t
+        self.emit(":", Ldone)
+        return self.result_in("A")
 
-    def gen_min(self, X, Y):
-        a = self.gen(X)
-        b = self.gen(Y)
-        t = self.new_temp()
+    def gen_min(self, a, b):
         Ldone = self.new_label()
 
-        self.loadA(a)
-        self.loadB(b)
-        self.emit("CMP A,B")
-        self.emit(f"JLE {Ldone}")
-        self.loadA(b)
+        self.load_pair(a, b)
+        self.release(a)
+        self.release(b)
+        self.emit("CMP", RA, RB)
+        self.emit("JLE", Ldone)
+        self.emit("MOV", RA, RB)
 
-        self.emit(f"{Ldone}:")
-        self.storeA(t)
-        return t
+        self.emit(":", Ldone)
+        return self.result_in("A")
 
-    def gen_abs(self, X):
-        x = self.gen(X)
-        t = self.new_temp()
+    def gen_abs(self, x):
         Lok = self.new_label()
 
-        self.loadA(x)
-        self.emit("CMP A,0")
-        self.emit(f"JGE {Lok}")
+        self.load("A", x)
+        self.free("B")
+        self.release(x)
+        self.emit("CMP", RA, imm(0))
+        self.emit("JGE", Lok)
 
-        self.emit("MOV B,A")
+        self.emit("MOV", RB, RA)
         self.moveA_imm(0)
-        self.emit("SUB A,B")
+        self.emit("SUB", RA, RB)
 
-        self.emit(f"{Lok}:")
-        self.storeA(t)
-        return t
+        self.emit(":", Lok)
+        return self.result_in("A")
 
 
 # ============================================================
-# COMPILER MAIN
+# MODO TAMAÑO: SUBRUTINAS COMPARTIDAS
 # ============================================================
+#
+# Cada *, / y % con lazo ocupa 40-80 instrucciones. En modo tamaño cada
+# sitio puede llamar a una subrutina compartida por tipo (ver
+# CodeGen.gen_call). El modelo de costo mide, con un CodeGen aparte, el
+# tamaño de cada sitio generado en el lugar y como llamada, y el de la
+# subrutina con los chequeos de sus llamadores. Solo cuenta la ROM: el
+# programa no tiene lazos propios, así que cada sitio corre a lo sumo una
+# vez y la llamada cuesta unos pocos ciclos fijos (CALL, RET y los
+# argumentos) contra las decenas o cientos del lazo.
+
+def sub_kind(ins, div=None):
+    # subrutina que puede hacer ins ("mul", "divmod", "div" o "mod"), o None.
+    # Un divmod de ir_fuse usa la de división y toma el resto de su celda
+    if ins.op not in ("*", "/", "%", "divmod"):
+        return None
+    L, R = ins.args
+    if ins.op == "*":
+        return None if is_const(L) or is_const(R) else "mul"
+    if is_const(R) and is_pow2(R[1]):
+        return None
+    if (div or DIV_STRATEGY) == "binary":
+        return "divmod"
+    return "mod" if ins.op == "%" else "div"
+
+
+def site_size(ins, mul, div, call):
+    # instrucciones de un sitio, con los operandos calculados en memoria
+    gen = CodeGen(mul, div)
+    args = [Val(f"x{i}") if a[0] == "tmp" else Val(a[1]) for i, a in enumerate(ins.args)]
+    ins.call = call
+    gen.gen_instr(ins, args)
+    ins.call = False
+    return len(gen.code)
+
+
+def subroutine_size(kind, checks, bound, mul, div):
+    gen = CodeGen(mul, div)
+    gen.gen_subroutine(kind, checks, bound)
+    return len(gen.code)
+
+
+def ir_calls(prog, mul=None, div=None):
+    # marca ins.call en los sitios que conviene llamar: los que ahorran
+    # ROM, si entre todos pagan la subrutina. Devuelve tipo -> llamadas.
+    sites = {}
+    for ins in prog.instrs:
+        kind = sub_kind(ins, div)
+        if kind is not None:
+            sites.setdefault(kind, []).append(ins)
+
+    calls = {}
+    for kind, group in sites.items():
+        gains = [(site_size(ins, mul, div, False) - site_size(ins, mul, div, True), ins)
+                 for ins in group]
+        useful = [ins for gain, ins in gains if gain > 0]
+        checks = set()
+        bound = 0
+        for ins in useful:
+            checks = None if checks is None or ins.checks is None else checks | ins.checks
+            bound = None if bound is None or ins.bound is None else max(bound, ins.bound)
+        saved = sum(g for g, _ in gains if g > 0)
+        if useful and saved > subroutine_size(kind, checks, bound, mul, div):
+            for ins in useful:
+                ins.call = True
+            calls[kind] = len(useful)
+    return calls
 
-def compile_to_asua(expr):
-    tokens = lex(expr)
-    p = Parser(tokens)
-    lhs, ast = p.parse_assignment()
 
-    if lhs != "result":
-        raise ValueError("La expresión debe ser de la forma: result = ...")
+# ============================================================
+# UTILIDADES ASUA
+# ============================================================
+
+JUMPS = ("JMP", "JEQ", "JNE", "JGT", "JGE", "JLT", "JLE")
+
+
+def split_instr(line):
+    # "MOV A,(x)" -> ("MOV", "A", "(x)")   "L3:" -> (":", "L3", None)
+    if line.endswith(":"):
+        return ":", line[:-1], None
+    op, _, args = line.partition(" ")
+    dst, _, src = args.partition(",")
+    return op, dst or None, src or None
+
+
+def is_mem(opnd):
+    return opnd is not None and opnd.startswith("(")
+
+
+def join_instr(op, dst, src):
+    if op == ":":
+        return f"{dst}:"
+    if dst is None:
+        return op
+    if src is None:
+        return f"{op} {dst}"
+    return f"{op} {dst},{src}"
+
+
+def count_mem(code):
+    reads = writes = 0
+    for op, dst, src in code:
+        if op == OP_LABEL:
+            continue
+        if kind_of(dst) == K_MEM:
+            if op == OP_MOV:
+                writes += 1
+            else:
+                reads += 1
+        if kind_of(src) == K_MEM:
+            reads += 1
+    return reads, writes
+
+
+def successors(code):
+    # sucesores de cada instrucción (índices) según el flujo de control.
+    # CALL sigue en la instrucción siguiente y en la subrutina; RET no
+    # tiene: las subrutinas no tocan temporales ni dejan nada en B
+    labels = {}
+    for i, (op, dst, _) in enumerate(code):
+        if op == OP_LABEL:
+            labels[dst] = i
+    succ = []
+    n = len(code)
+    for i, (op, dst, _) in enumerate(code):
+        nxt = [i + 1] if i + 1 < n else []
+        if op == OP_JMP:
+            succ.append([labels[dst]])
+        elif op in OP_TARGET:
+            succ.append(nxt + [labels[dst]])
+        elif op == OP_HLT or op == OP_RET:
+            succ.append([])
+        else:
+            succ.append(nxt)
+    return succ
+
+
+def machine_blocks(code):
+    # bloques básicos del código: (inicio, fin) con fin exclusivo. Un
+    # bloque empieza en un label o después de un salto, CALL, RET o HLT.
+    n = len(code)
+    starts = {0}
+    for i, (op, _, _) in enumerate(code):
+        if op == OP_LABEL:
+            starts.add(i)
+        elif op in OP_TARGET or op == OP_HLT or op == OP_RET:
+            starts.add(i + 1)
+    starts = sorted(i for i in starts if i < n)
+    return list(zip(starts, starts[1:] + [n]))
+
+
+def block_graph(code):
+    # (bloques, sucesores de cada bloque como índices de bloque)
+    succ = successors(code)
+    blocks = machine_blocks(code)
+    block_at = {start: k for k, (start, _) in enumerate(blocks)}
+    return blocks, [[block_at[j] for j in succ[end - 1]] for _, end in blocks]
+
+
+def reverse_postorder(bsucc):
+    # bloques que se alcanzan desde el primero, en orden posterior
+    # inverso: salvo por los saltos hacia atrás de los lazos, cada bloque
+    # va después de sus predecesores
+    post = []
+    seen = [False] * len(bsucc)
+    seen[0] = True
+    stack = [(0, 0)]
+    while stack:
+        k, i = stack.pop()
+        if i < len(bsucc[k]):
+            stack.append((k, i + 1))
+            b = bsucc[k][i]
+            if not seen[b]:
+                seen[b] = True
+                stack.append((b, 0))
+        else:
+            post.append(k)
+    return post[::-1]
+
+
+def reg_effects(ins):
+    # registros (leídos, escritos); None si es label, salto o HLT
+    op, dst, src = ins
+    if op == OP_MOV:
+        return ({src} if kind_of(src) == K_REG else set()), ({dst} if kind_of(dst) == K_REG else set())
+    if op in OP_WRITES:
+        return {o for o in (dst, src) if kind_of(o) == K_REG}, {dst}
+    if op == OP_CMP:
+        return {o for o in (dst, src) if kind_of(o) == K_REG}, set()
+    return None
+
+
+# ============================================================
+# PEEPHOLE
+# ============================================================
+
+# MOV A,A
+def rule_self_move(opt, win):
+    op, dst, src = win[0]
+    if op == OP_MOV and kind_of(dst) == K_REG and dst == src:
+        return []
+    return None
+
+
+# MOV (x),A ; MOV A,(x)  ->  MOV (x),A
+# MOV (x),A ; MOV B,(x)  ->  MOV (x),A ; MOV B,A
+def rule_store_reload(opt, win):
+    op1, d1, s1 = win[0]
+    op2, d2, s2 = win[1]
+    if (op1 == op2 == OP_MOV and kind_of(d1) == K_MEM and kind_of(s1) == K_REG
+            and s2 == d1 and kind_of(d2) == K_REG):
+        if d2 == s1:
+            return [win[0]]
+        return [win[0], (OP_MOV, d2, s1)]
+    return None
+
+
+# MOV A,(x) ; MOV (x),A  ->  MOV A,(x)
+def rule_reload_store(opt, win):
+    op1, d1, s1 = win[0]
+    op2, d2, s2 = win[1]
+    if op1 == op2 == OP_MOV and kind_of(d1) == K_REG and kind_of(s1) == K_MEM and d2 == s1 and s2 == d1:
+        return [win[0]]
+    return None
+
+
+# MOV A,x ; <pisa A sin leerlo>  ->  <pisa A sin leerlo>
+def rule_dead_move(opt, win):
+    op, dst, src = win[0]
+    if op == OP_MOV and kind_of(dst) == K_REG:
+        eff = reg_effects(win[1])
+        if eff is not None:
+            reads, writes = eff
+            if dst in writes and dst not in reads:
+                return [win[1]]
+    return None
+
+
+# MOV A,(x) ; MOV B,A ; <pisa A sin leerlo>  ->  MOV B,(x) ; <...>
+def rule_load_via_A(opt, win):
+    op1, d1, s1 = win[0]
+    if op1 == OP_MOV and d1 == RA and kind_of(s1) != K_REG and win[1] == (OP_MOV, RB, RA):
+        eff = reg_effects(win[2])
+        if eff is not None:
+            reads, writes = eff
+            if RA in writes and RA not in reads:
+                return [(OP_MOV, RB, s1), win[2]]
+    return None
+
+
+# JMP L ; L:  ->  L:   (también saltos condicionales)
+def rule_jump_next(opt, win):
+    op1, d1, _ = win[0]
+    op2, d2, _ = win[1]
+    if op1 in OP_JUMPS and op2 == OP_LABEL and d1 == d2:
+        opt.refs[d1] -= 1
+        return [win[1]]
+    return None
+
+
+# Jcc L1 ; JMP L2 ; L1:  ->  Jncc L2 ; L1:
+INVERT = {OPCODE[a]: OPCODE[b] for a, b in (
+    ("JEQ", "JNE"), ("JNE", "JEQ"), ("JGT", "JLE"),
+    ("JLE", "JGT"), ("JGE", "JLT"), ("JLT", "JGE"))}
+
+
+def rule_invert_branch(opt, win):
+    op1, d1, _ = win[0]
+    op2, d2, _ = win[1]
+    op3, d3, _ = win[2]
+    if op1 in INVERT and op2 == OP_JMP and op3 == OP_LABEL and d1 == d3:
+        opt.refs[d1] -= 1
+        return [(INVERT[op1], d2, NO), win[2]]
+    return None
+
+
+# L1: ; L2:  ->  L1:   (las referencias a L2 pasan a L1)
+def rule_merge_labels(opt, win):
+    op1, d1, _ = win[0]
+    op2, d2, _ = win[1]
+    if op1 == op2 == OP_LABEL:
+        opt.rename_label(d2, d1)
+        return [win[0]]
+    return None
+
+
+# label sin ningún salto hacia él
+def rule_unused_label(opt, win):
+    op, name, _ = win[0]
+    if op == OP_LABEL and opt.refs.get(name, 0) == 0:
+        return []
+    return None
+
+
+PEEPHOLE_RULES = [
+    ("self_move", 1, rule_self_move),
+    ("store_reload", 2, rule_store_reload),
+    ("reload_store", 2, rule_reload_store),
+    ("dead_move", 2, rule_dead_move),
+    ("load_via_A", 3, rule_load_via_A),
+    ("jump_next", 2, rule_jump_next),
+    ("invert_branch", 3, rule_invert_branch),
+    ("merge_labels", 2, rule_merge_labels),
+    ("unused_label", 1, rule_unused_label),
+]
+WINDOW = max(size for _, size, _ in PEEPHOLE_RULES)
+
+
+class Peephole:
+    def __init__(self, rules=None):
+        # rules: nombres de reglas a activar (None = todas)
+        self.rules = [r for r in PEEPHOLE_RULES if rules is None or r[0] in rules]
+        self.hits = {name: 0 for name, _, _ in self.rules}
+        self.code = None
+        self.refs = {}
+        # labels juntados en esta pasada: viejo -> nuevo
+        self.alias = {}
+
+    def count_refs(self):
+        self.refs = {}
+        for op, dst, _ in self.code:
+            if op in OP_TARGET:
+                self.refs[dst] = self.refs.get(dst, 0) + 1
+
+    def rename_label(self, old, new):
+        # las referencias a old pasan a new: solo se anota; los saltos se
+        # reescriben al entrar en la ventana o al final de la pasada
+        self.alias[old] = new
+        self.refs[new] = self.refs.get(new, 0) + self.refs.pop(old, 0)
+
+    def target(self, label):
+        while label in self.alias:
+            label = self.alias[label]
+        return label
+
+    def retarget(self, i, ins):
+        # ins (la instrucción i) con el destino del salto al día
+        op, dst, src = ins
+        if op in OP_TARGET and dst in self.alias:
+            ins = (op, self.target(dst), src)
+            self.code.set(i, *ins)
+        return ins
+
+    def sweep(self):
+        changed = False
+        code = self.code
+        i = 0
+        while i < len(code):
+            full = code.window(i, WINDOW)
+            if self.alias:
+                full = [self.retarget(i + k, ins) for k, ins in enumerate(full)]
+            for name, size, fn in self.rules:
+                if len(full) < size:
+                    continue
+                new = fn(self, full[:size])
+                if new is not None:
+                    code.replace(i, size, new)
+                    self.hits[name] += 1
+                    changed = True
+                    # retroceder: el reemplazo puede habilitar otra regla
+                    i = max(i - 2, 0)
+                    break
+            else:
+                i += 1
+        if self.alias:
+            for i, ins in enumerate(code):
+                self.retarget(i, ins)
+            self.alias = {}
+        return changed
+
+    def run(self, code):
+        # code: Code; se optimiza en el lugar
+        self.code = code
+        self.count_refs()
+        while self.sweep():
+            self.count_refs()
+        return self.code
+
+
+# ============================================================
+# REUSO DE TEMPORALES (LIVENESS + COLOREO)
+# ============================================================
+
+TEMP_RE = re.compile(r"t\d+$")
 
-    ast = simplify(ast)
 
-    gen = CodeGen()
-    final_loc = gen.gen(ast)
+def temp_cells(code):
+    # ids de las celdas que son temporales
+    return {i for i, name in enumerate(code.cells.names) if TEMP_RE.match(name)}
 
 
-    gen.loadA(final_loc)
-    gen.emit("MOV (result),A")
-    gen.mem_write()
-    gen.emit(f"JMP {gen.end_label}")
+def temp_uses_defs(ins, temps):
+    op, dst, src = ins
+    uses, defs = set(), set()
+    if op == OP_LABEL:
+        return uses, defs
+    if kind_of(dst) == K_MEM and val_of(dst) in temps:
+        if op == OP_MOV:
+            defs.add(val_of(dst))
+        else:
+            uses.add(val_of(dst))
+    if kind_of(src) == K_MEM and val_of(src) in temps:
+        uses.add(val_of(src))
+    return uses, defs
+
+
+def bit_set(cells):
+    # conjunto de celdas -> int con esos bits en 1
+    mask = 0
+    for c in cells:
+        mask |= 1 << c
+    return mask
+
+
+def bit_members(mask):
+    # celdas con su bit en 1
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def temp_liveness(code):
+    # (usos y definiciones de cada instrucción, bloques, temporales vivos
+    # a la entrada y al final de cada bloque). Punto fijo sobre los
+    # bloques básicos, con los conjuntos como bits de un int (ver
+    # bit_set); adentro de un bloque cada pase lo recorre hacia atrás
+    # desde lo vivo al final (ver reuse_temps y copy_propagate)
+    temps = temp_cells(code)
+    ud = [temp_uses_defs(ins, temps) for ins in code]
+    blocks, bsucc = block_graph(code)
+    preds = [[] for _ in blocks]
+    for k, succ in enumerate(bsucc):
+        for j in succ:
+            preds[j].append(k)
+
+    buse, bdef = [], []
+    for start, end in blocks:
+        use = dfn = 0
+        for i in range(end - 1, start - 1, -1):
+            uses, defs = ud[i]
+            if uses or defs:
+                d = bit_set(defs)
+                use = bit_set(uses) | (use & ~d)
+                dfn |= d
+        buse.append(use)
+        bdef.append(dfn)
+
+    # de atrás hacia adelante; un bloque vuelve a la cola cuando cambia lo
+    # vivo a la entrada de un sucesor (solo en los lazos)
+    live_in = [0] * len(blocks)
+    live_end = [0] * len(blocks)
+    work = list(range(1 - len(blocks), 1))
+    queued = [True] * len(blocks)
+    while work:
+        k = -heapq.heappop(work)
+        queued[k] = False
+        out = 0
+        for j in bsucc[k]:
+            out |= live_in[j]
+        live_end[k] = out
+        inn = buse[k] | (out & ~bdef[k])
+        if inn != live_in[k]:
+            live_in[k] = inn
+            for p in preds[k]:
+                if not queued[p]:
+                    queued[p] = True
+                    heapq.heappush(work, -p)
+    return ud, blocks, live_in, live_end
+
+
+def reuse_temps(code):
+    # asigna los temporales a la menor cantidad de celdas: dos temporales
+    # comparten celda si nunca están vivos a la vez. Renombra en el lugar.
+    # Cada temporal ocupa su celda en un intervalo, contado en medias
+    # instrucciones (2i: la instrucción i lee, 2i+1: escribe): desde que
+    # se escribe o entra vivo a un bloque hasta que se lee o sale vivo de
+    # un bloque por última vez. Las celdas se reparten de menor a mayor en
+    # el orden en que empiezan los intervalos (linear scan)
+    ud, blocks, live_in, live_end = temp_liveness(code)
+
+    # las puntas que ponen los bordes de bloque: la primera entrada viva y
+    # la última salida viva de cada temporal
+    first, last = {}, {}
+    seen = 0
+    for k, (start, _) in enumerate(blocks):
+        for t in bit_members(live_in[k] & ~seen):
+            first[t] = 2 * start
+        seen |= live_in[k]
+    seen = 0
+    for k in range(len(blocks) - 1, -1, -1):
+        for t in bit_members(live_end[k] & ~seen):
+            last[t] = 2 * blocks[k][1] - 1
+        seen |= live_end[k]
+
+    for i, (uses, defs) in enumerate(ud):
+        for t, pos in [(t, 2 * i) for t in uses] + [(t, 2 * i + 1) for t in defs]:
+            if pos < first.get(t, pos + 1):
+                first[t] = pos
+            if pos > last.get(t, pos - 1):
+                last[t] = pos
+
+    slot = {}
+    free = []
+    active = []
+    slots = 0
+    for t in sorted(first, key=first.get):
+        while active and active[0][0] < first[t]:
+            heapq.heappush(free, heapq.heappop(active)[1])
+        if free:
+            k = heapq.heappop(free)
+        else:
+            slots += 1
+            k = slots
+        slot[t] = k
+        heapq.heappush(active, (last[t], k))
+
+    cell = {t: opnd(K_MEM, code.cells.intern(f"t{k}")) for t, k in slot.items()}
+    for i, (op, dst, src) in enumerate(code):
+        new_dst = cell.get(val_of(dst), dst) if kind_of(dst) == K_MEM else dst
+        new_src = cell.get(val_of(src), src) if kind_of(src) == K_MEM else src
+        if new_dst != dst or new_src != src:
+            code.set(i, op, new_dst, new_src)
+    return code, len(slot), slots
+
+
+# ============================================================
+# PROPAGACIÓN DE COPIAS Y STORES MUERTOS
+# ============================================================
+#
+# Las plantillas copian celdas enteras (l -> t_a, t_acc -> resultado,
+# cociente -> A ...). Análisis hacia adelante de copias disponibles: el
+# estado dice qué registros y qué temporales tienen el mismo valor que
+# otra celda (siempre la original de la cadena de copias). En la
+# intersección de todos los caminos:
+#  - leer un temporal que es copia de x pasa a leer x;
+#  - MOV R,(x) con R que ya tiene x, o MOV (x),R con x que ya tiene lo
+#    de R, se borran;
+# y después se borran los stores a temporales que nadie lee.
+
+def copy_kill(state, cell):
+    # cell cambió: deja de ser copia y sus copias dejan de valer
+    state.pop(cell, None)
+    for k in [k for k, v in state.items() if v == cell]:
+        del state[k]
+
+
+def copy_step(state, ins, temps, drop=None):
+    # aplica ins al estado; con drop (lista) devuelve la instrucción con
+    # los temporales reemplazados, o None si sobra
+    op, dst, src = ins
+    if drop is not None and op != OP_LABEL:
+        if kind_of(src) == K_MEM and val_of(src) in temps:
+            src = state.get(src, src)
+        if op != OP_MOV and kind_of(dst) == K_MEM and val_of(dst) in temps:
+            dst = state.get(dst, dst)
+
+    if op == OP_MOV:
+        if kind_of(dst) == K_REG:
+            if kind_of(src) == K_MEM:
+                root = state.get(src, src)
+                if drop is not None and state.get(dst) == root:
+                    return None
+                state[dst] = root
+            elif kind_of(src) == K_REG and src in state:
+                state[dst] = state[src]
+            else:
+                state.pop(dst, None)
+        else:
+            v = state.get(src) if kind_of(src) == K_REG else None
+            if v is not None and (v == dst or state.get(dst) == v):
+                if drop is not None:
+                    return None
+                return ins
+            copy_kill(state, dst)
+            if kind_of(src) == K_REG:
+                if v is None:
+                    state[src] = dst
+                elif val_of(dst) in temps:
+                    state[dst] = v
+    elif op in OP_WRITES:
+        copy_kill(state, dst)
+    elif op == OP_CALL:
+        state.clear()
+    return op, dst, src
+
+
+def copy_propagate(code):
+    # en el lugar; devuelve (lecturas reemplazadas, instrucciones borradas)
+    temps = temp_cells(code)
+    blocks, bsucc = block_graph(code)
+
+    # punto fijo: estado a la entrada de cada bloque (None = sin calcular).
+    # Los bloques salen de la cola en orden posterior inverso, así que
+    # solo se repiten los de un lazo. Los estados solo pierden copias: a
+    # un sucesor ya visto se le sacan las que no valen en este camino
+    order = reverse_postorder(bsucc)
+    rank = {k: i for i, k in enumerate(order)}
+    state_in = [None] * len(blocks)
+    state_in[0] = {}
+    queued = [False] * len(blocks)
+    work = [0]
+    while work:
+        k = order[heapq.heappop(work)]
+        queued[k] = False
+        start, end = blocks[k]
+        state = dict(state_in[k])
+        for i in range(start, end):
+            copy_step(state, code[i], temps)
+        for b in bsucc[k]:
+            old = state_in[b]
+            if old is None:
+                state_in[b] = dict(state)
+            else:
+                gone = [x for x, v in old.items() if state.get(x) != v]
+                if not gone:
+                    continue
+                for x in gone:
+                    del old[x]
+            if not queued[b]:
+                queued[b] = True
+                heapq.heappush(work, rank[b])
+
+    replaced = 0
+    drop = set()
+    for k, (start, end) in enumerate(blocks):
+        state = dict(state_in[k] or {})
+        for i in range(start, end):
+            ins = code[i]
+            new = copy_step(state, ins, temps, drop)
+            if new is None:
+                drop.add(i)
+            elif new != ins:
+                code.set(i, *new)
+                replaced += 1
+    code.remove(drop)
+    removed = len(drop)
+
+    # stores a temporales que no se leen: hacia atrás en cada bloque
+    ud, blocks, _, live_end = temp_liveness(code)
+    drop = set()
+    for k, (start, end) in enumerate(blocks):
+        live = live_end[k]
+        for i in range(end - 1, start - 1, -1):
+            uses, defs = ud[i]
+            if uses or defs:
+                d = bit_set(defs)
+                if d and not d & live:
+                    drop.add(i)
+                live = bit_set(uses) | (live & ~d)
+    code.remove(drop)
+    return replaced, removed + len(drop)
+
+
+# ============================================================
+# LIMPIEZA DEL FLUJO DE CONTROL
+# ============================================================
+#
+# Saltos a saltos, saltos sobre saltos y código al que no se llega (la
+# rutina de error cuando ninguna operación puede fallar). Lo local
+# (invertir Jcc L1 ; JMP L2 ; L1:, juntar labels, JMP L ; L:) lo hacen
+# reglas del peephole; acá va lo que necesita ver todo el programa.
+
+CFG_RULES = ["invert_branch", "jump_next", "merge_labels", "unused_label"]
+
+
+def thread_jumps(code):
+    # un salto a L, si lo primero en L es JMP M (o el mismo Jcc, que ve
+    # los mismos flags), salta directo a M; JMP a un HLT o RET es ese
+    # HLT o RET.
+    # Devuelve cuántos saltos cambiaron.
+    at = {}
+    nxt = None
+    for i in range(len(code) - 1, -1, -1):
+        op, dst, _ = code[i]
+        if op == OP_LABEL:
+            at[dst] = nxt
+        else:
+            nxt = i
+
+    threaded = 0
+    for i, (op, dst, src) in enumerate(code):
+        if op not in OP_JUMPS:
+            continue
+        label = dst
+        seen = {label}
+        while at[label] is not None:
+            jop, jdst, _ = code[at[label]]
+            if jop != OP_JMP and jop != op or jdst in seen:
+                break
+            label = jdst
+            seen.add(label)
+        if op == OP_JMP and at[label] is not None and code[at[label]][0] in (OP_HLT, OP_RET):
+            code.set(i, code[at[label]][0])
+            threaded += 1
+        elif label != dst:
+            code.set(i, op, label, src)
+            threaded += 1
+    return threaded
+
+
+def remove_unreachable(code):
+    # borra lo que no se alcanza desde la primera instrucción; devuelve
+    # cuántas instrucciones borró
+    succ = successors(code)
+    reached = set()
+    stack = [0] if len(code) else []
+    while stack:
+        i = stack.pop()
+        if i in reached:
+            continue
+        reached.add(i)
+        stack.extend(succ[i])
+    drop = set(range(len(code))) - reached
+    code.remove(drop)
+    return len(drop)
+
+
+def clean_cfg(code):
+    # en el lugar, hasta que no cambie nada; devuelve los contadores
+    stats = {"threaded": 0, "inverted": 0, "unreachable": 0}
+    opt = Peephole(CFG_RULES)
+    while True:
+        threaded = thread_jumps(code)
+        dead = remove_unreachable(code)
+        before = sum(opt.hits.values())
+        opt.run(code)
+        stats["threaded"] += threaded
+        stats["unreachable"] += dead
+        if not threaded and not dead and sum(opt.hits.values()) == before:
+            break
+    stats["inverted"] = opt.hits["invert_branch"]
+    return stats
+
+
+# ============================================================
+# PASES
+# ============================================================
+#
+# Un pase es una función que recibe la unidad de compilación y la
+# modifica. Fases, en este orden: "ir" (sobre unit.ir), "lower" (arma
+# unit.code desde el IR) y "asm" (sobre unit.code). Lo que reporta cada
+# pase va a unit.stats.
+#
+# Cada pase es lineal en el largo del código, salvo los heaps de los
+# análisis de flujo (n log n), también con muchos saltos (max, lazos de
+# * y /). benchmark.py --scaling lo controla.
+
+class Unit:
+    def __init__(self, ir, options):
+        self.ir = ir
+        self.options = options
+        self.gen = None
+        self.code = None
+        self.stats = {}
 
-    # RUTINA ERROR FINAL (overflow / div0)
-    gen.emit(f"{gen.error_label}:")
-    gen.moveA_imm(1)
-    gen.emit("MOV (error),A")
-    gen.mem_write()
-    gen.moveA_imm(0)
-    gen.emit("MOV (result),A")
-    gen.mem_write()
-    gen.emit(f"JMP {gen.end_label}")
 
-    gen.emit(f"{gen.end_label}:")
-    gen.emit("HLT")
+def pass_cse(unit):
+    unit.stats["cse_hits"] = ir_cse(unit.ir)
 
+
+def lowered_cost(unit):
+    # (spills, accesos a memoria) de bajar el IR tal como está, sin pases
+    # de asm
+    gen = CodeGen(unit.options["mul"], unit.options["div"])
+    reads, writes = count_mem(gen.lower(unit.ir))
+    return gen.spills, reads + writes
+
+
+def pass_order(unit):
+    # con la división por resta repetida un divisor negativo no termina:
+    # adelantarla podría colgar un programa que antes terminaba con error
+    fixed = (unit.options["div"] or DIV_STRATEGY) == "repeat"
+    spills, mem = lowered_cost(unit)
+    unit.stats["reordered"] = ir_order(unit.ir, fixed)
+    # lo que ahorra contra el orden de izquierda a derecha del árbol
+    if unit.stats["reordered"]:
+        after = lowered_cost(unit)
+        spills, mem = spills - after[0], mem - after[1]
+    else:
+        spills = mem = 0
+    unit.stats["order_saved"] = {"spills": spills, "mem_accesses": mem}
+
+
+def pass_ranges(unit):
+    # sin la opción ranges solo hacen falta las cotas de los dividendos
+    inputs = unit.options["ranges"]
+    if not inputs:
+        ir_ranges(unit.ir, checks=False)
+        return
+    unit.stats["checks_removed"] = ir_ranges(unit.ir, None if inputs is True else inputs)
+
+
+def pass_fuse(unit):
+    unit.stats["fused"] = ir_fuse(unit.ir)
+
+
+def pass_calls(unit):
+    unit.stats["calls"] = ir_calls(unit.ir, unit.options["mul"], unit.options["div"])
+
+
+def pass_lower(unit):
+    unit.gen = CodeGen(unit.options["mul"], unit.options["div"])
+    unit.code = unit.gen.lower(unit.ir, unit.options["fragment"])
+
+
+def pass_peephole(unit):
+    rules = unit.options["peephole"]
+    opt = Peephole(None if rules is True else rules)
+    opt.run(unit.code)
+    # puede correr más de una vez: se suman los aciertos
+    hits = unit.stats.setdefault("peephole", {})
+    for name, n in opt.hits.items():
+        hits[name] = hits.get(name, 0) + n
+
+
+def pass_copies(unit):
+    replaced, removed = copy_propagate(unit.code)
+    unit.stats["copies"] = unit.stats.get("copies", 0) + replaced
+    unit.stats["dead_stores"] = unit.stats.get("dead_stores", 0) + removed
+
+
+def pass_cfg(unit):
+    unit.stats["cfg"] = clean_cfg(unit.code)
+
+
+def pass_reuse(unit):
+    _, temps, slots = reuse_temps(unit.code)
+    unit.stats["temps"] = temps
+    unit.stats["slots"] = slots
+
+
+STAGES = ("ir", "lower", "asm")
+
+# nombre -> (fase, función)
+PASSES = {
+    "cse": ("ir", pass_cse),
+    "order": ("ir", pass_order),
+    "ranges": ("ir", pass_ranges),
+    "fuse": ("ir", pass_fuse),
+    "calls": ("ir", pass_calls),
+    "lower": ("lower", pass_lower),
+    "copies": ("asm", pass_copies),
+    "cfg": ("asm", pass_cfg),
+    "peephole": ("asm", pass_peephole),
+    "reuse": ("asm", pass_reuse),
+}
+
+
+def unit_size(unit):
+    # tamaño del programa en este punto: instrucciones del IR antes de
+    # bajarlo; líneas, lecturas y escrituras después
+    if unit.code is None:
+        return {"instrs": len(unit.ir.instrs)}
+    reads, writes = count_mem(unit.code)
+    return {"lines": len(unit.code), "reads": reads, "writes": writes}
+
+
+class PassManager:
+    def __init__(self, names, report=False):
+        # names: pases a correr, en orden; exactamente un "lower" y las
+        # fases sin retroceder. Con report, cada corrida de un pase deja
+        # en self.report su tiempo y unit_size antes y después
+        order = [STAGES.index(PASSES[n][0]) for n in names]
+        if order != sorted(order) or names.count("lower") != 1:
+            raise ValueError(f"Orden de pases inválido: {names}")
+        self.names = list(names)
+        self.timings = {}
+        self.report = [] if report else None
+
+    def run(self, unit):
+        for name in self.names:
+            if self.report is not None:
+                before = unit_size(unit)
+            start = time.perf_counter()
+            PASSES[name][1](unit)
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0) + elapsed
+            if self.report is not None:
+                self.report.append({"pass": name, "time": elapsed,
+                                    "before": before, "after": unit_size(unit)})
+        return unit
+
+
+def format_report(report):
+    # una línea por corrida de pase: tiempo y antes -> después (cambio)
+    lines = [f"{'pase':<10}{'ms':>9}  cambios"]
+    for entry in report:
+        before, after = entry["before"], entry["after"]
+        parts = []
+        for m in ("instrs", "lines", "reads", "writes"):
+            if m not in after:
+                continue
+            if m in before:
+                parts.append(f"{m} {before[m]}->{after[m]} ({after[m] - before[m]:+d})")
+            else:
+                parts.append(f"{m} {after[m]}")
+        lines.append(f"{entry['pass']:<10}{entry['time'] * 1000:>9.3f}  " + ", ".join(parts))
+    return lines
+
+
+# ============================================================
+# COMPILER MAIN
+# ============================================================
+
+def parse_result(expr):
+    # una sola sentencia: los fines de línea son espacio y después solo
+    # puede haber ";" (para varias, parse_program)
+    tokens = (tok for tok in lex(expr) if tok != ("SEP", "\n"))
+    p = Parser(tokens)
+    lhs, ast = p.parse_assignment()
+    while p.cur()[0] == "SEP":
+        p.eat()
+    if p.cur() != EOF:
+        raise ValueError(f"Sobra después de la expresión: {p.cur()[0]} '{p.cur()[1]}'")
+
+    if lhs != "result":
+        raise ValueError("La expresión debe ser de la forma: result = ...")
+    return ast
+
+
+# ============================================================
+# NIVELES DE OPTIMIZACIÓN
+# ============================================================
+#
+# Cada nivel fija las opciones que eligen los pases; lo que se pase
+# explícitamente a compile_ast (distinto de None) va por encima.
+#  - O0: el código de las plantillas tal cual;
+#  - O1: lo local y barato (peephole, reuso de temporales, CSE, / y %
+#    juntos, flujo de control);
+#  - O2: todos los pases (por defecto);
+#  - Os: O2 más el modo tamaño.
+
+OPT_LEVELS = {
+    "O0": {"peephole": False, "reuse": False, "cse": False, "superopt": False, "order": False,
+           "copies": False, "cfg": False, "ranges": False, "fuse": False, "size": False},
+    "O1": {"peephole": True, "reuse": True, "cse": True, "superopt": False, "order": False,
+           "copies": False, "cfg": True, "ranges": False, "fuse": True, "size": False},
+    "O2": {"peephole": True, "reuse": True, "cse": True, "superopt": True, "order": True,
+           "copies": True, "cfg": True, "ranges": True, "fuse": True, "size": False},
+}
+OPT_LEVELS["Os"] = dict(OPT_LEVELS["O2"], size=True)
+DEFAULT_LEVEL = "O2"
+
+
+def level_options(level=None, **options):
+    # opciones del nivel ("O2", "-O2" o "2") con las que no son None encima
+    name = str(DEFAULT_LEVEL if level is None else level).lstrip("-")
+    if not name.startswith("O"):
+        name = "O" + name
+    if name not in OPT_LEVELS:
+        raise ValueError(f"Nivel de optimización no soportado: {level}")
+    opts = dict(OPT_LEVELS[name])
+    opts.update((k, v) for k, v in options.items() if v is not None)
+    return opts
+
+
+def compile_to_asua(expr, **options):
+    return compile_ast(simplify(parse_result(expr)), **options)
+
+
+def parse_program(source):
+    return Parser(lex(source)).parse_program()
+
+
+def compile_program(source, outputs=None, **options):
+    # varias sentencias en una sola unidad: un solo conjunto de
+    # temporales, una rutina de error y CSE entre sentencias
+    return compile_ast(parse_program(source), outputs=outputs, **options)
+
+
+def compile_ast(ast, level=None, peephole=None, reuse=None, mul=None, div=None, cse=None,
+                superopt=None, order=None, copies=None, cfg=None, ranges=None,
+                fuse=None, size=None, text=True, timing=False, outputs=None, fragment=False,
+                ir=False):
+    # ast: árbol ya simplificado, o lista de sentencias (nombre, árbol) de
+    # un programa (ver build_ir)
+    # level: nivel de optimización (ver OPT_LEVELS); las opciones de pases
+    # en None quedan como dice el nivel
+    # peephole: True (todas las reglas), False, o lista de nombres de reglas
+    # reuse: comparte celdas entre temporales que no están vivos a la vez
+    # mul, div: estrategias de multiplicación y división (por defecto
+    # MUL_STRATEGY y DIV_STRATEGY)
+    # cse: calcula una sola vez las subexpresiones repetidas
+    # superopt: usa las secuencias de superopt_table.json
+    # order: elige el orden de evaluación de los operandos (ir_order)
+    # copies: propagación de copias y stores muertos (copy_propagate)
+    # cfg: saltos encadenados, saltos sobre saltos y código inalcanzable
+    # (clean_cfg)
+    # ranges: omite los chequeos de error que no pueden fallar (ir_ranges);
+    # True (entradas en INPUT_RANGE), False, o dict nombre -> (min, max)
+    # fuse: x / y y x % y de los mismos operandos en una sola división
+    # (ir_fuse)
+    # size: modo tamaño, *, / y % como subrutinas compartidas donde ahorran
+    # ROM (ir_calls)
+    # text: devuelve las líneas ASUA; con False, el Code sin renderizar
+    # (para escribirlo directo a un archivo con Code.write)
+    # timing: agrega stats["passes"] con el tiempo y el tamaño antes y
+    # después de cada pase (ver PassManager)
+    # outputs: en un programa, los nombres que se guardan en memoria
+    # fragment: código para enlazar con otros (ver CodeGen.lower); sin
+    # rutina de error ni subrutinas
+    # ir: agrega stats["ir"] con las líneas del IR que se bajó, después de
+    # los pases de la fase "ir" (ver format_ir)
+    opts = level_options(level, peephole=peephole, reuse=reuse, cse=cse, superopt=superopt,
+                         order=order, copies=copies, cfg=cfg, ranges=ranges, fuse=fuse,
+                         size=size)
+    peephole, reuse, cse, superopt, order, copies, cfg, ranges, fuse, size = (
+        opts[k] for k in ("peephole", "reuse", "cse", "superopt", "order", "copies",
+                          "cfg", "ranges", "fuse", "size"))
+    if fragment:
+        # las subrutinas irían después del HLT final, que un fragmento no
+        # tiene
+        size = False
+
+    passes = (["cse"] if cse else []) + (["order"] if order else [])
+    if ranges or not fragment:
+        # también sin ranges, por las cotas de los dividendos; en un
+        # fragmento un hueco puede valer cualquier cosa
+        passes.append("ranges")
+    if fuse:
+        # después de ranges, que no conoce divmod ni rem
+        passes.append("fuse")
+    if size:
+        passes.append("calls")
+    passes.append("lower")
+    if peephole:
+        passes.append("peephole")
+    if reuse:
+        passes.append("reuse")
+    if copies:
+        # después del reuso, que deja copias de una celda en sí misma;
+        # el peephole de nuevo limpia las cargas que quedaron sin uso
+        passes.append("copies")
+        if peephole:
+            passes.append("peephole")
+    if cfg:
+        passes.append("cfg")
+
+    unit = Unit(build_ir(ast, superopt, outputs), {"peephole": peephole, "mul": mul, "div": div,
+                                                   "ranges": ranges, "fragment": fragment})
+    manager = PassManager(passes, timing)
+    manager.run(unit)
+
+    code = unit.code
+    reads, writes = count_mem(code)
     stats = {
-        "lines": len(gen.code),
-        "reads": gen.reads,
-        "writes": gen.writes,
-        "mem_accesses": gen.reads + gen.writes,
+        "lines": len(code),
+        "reads": reads,
+        "writes": writes,
+        "mem_accesses": reads + writes,
+        "peephole": unit.stats.get("peephole", {}),
+        "temps": unit.stats.get("temps", unit.gen.temp_counter),
+        "slots": unit.stats.get("slots", unit.gen.temp_counter),
+        "cse_hits": unit.stats.get("cse_hits", 0),
+        "reordered": unit.stats.get("reordered", 0),
+        "order_saved": unit.stats.get("order_saved", {}),
+        "spills": unit.gen.spills,
+        "copies": unit.stats.get("copies", 0),
+        "dead_stores": unit.stats.get("dead_stores", 0),
+        "cfg": unit.stats.get("cfg", {}),
+        "checks_removed": unit.stats.get("checks_removed", 0),
+        "fused": unit.stats.get("fused", 0),
+        "calls": unit.stats.get("calls", {}),
     }
-    return gen.code, stats
+    if timing:
+        stats["passes"] = manager.report
+    if ir:
+        stats["ir"] = format_ir(unit.ir)
+    if text:
+        code = code.lines()
+    return code, stats
 
 
 if __name__ == "__main__":
-    expr = input("Expr: ")
-    code, stats = compile_to_asua(expr)
-    print("\nCODE:")
-    for line in code:
-        print(line)
-    print("\n# Stats:", stats)
\ No newline at end of file
+    # python compiler.py -Os --time "result = a*b + c*d"
+    ap = argparse.ArgumentParser(description="Compila una expresión a ASUA")
+    ap.add_argument("expr", nargs="?", help="expresión (si falta, se pide por stdin)")
+    ap.add_argument("-O", dest="level", choices=("0", "1", "2", "s"), default=None,
+                    help=f"nivel de optimización (por defecto {DEFAULT_LEVEL})")
+    ap.add_argument("--time", action="store_true",
+                    help="tiempo y cambio de lines/reads/writes de cada pase")
+    ap.add_argument("--emit", choices=("asm", "ir", "all"), default="asm",
+                    help="qué mostrar: el código ASUA, el IR que se bajó o los dos")
+    ap.add_argument("-p", "--program", metavar="ARCHIVO",
+                    help="programa de varias sentencias ('-' para stdin)")
+    ap.add_argument("--outputs", default=None,
+                    help="salidas del programa separadas por coma (por defecto, todo lo asignado)")
+    args = ap.parse_args()
+
+    options = {"level": args.level, "text": False, "timing": args.time,
+               "ir": args.emit != "asm"}
+    if args.program is not None:
+        if args.program == "-":
+            source = sys.stdin.read()
+        else:
+            with open(args.program, encoding="utf-8") as f:
+                source = f.read()
+        outputs = args.outputs.split(",") if args.outputs else None
+        code, stats = compile_program(source, outputs, **options)
+    else:
+        expr = args.expr if args.expr is not None else input("Expr: ")
+        code, stats = compile_to_asua(expr, **options)
+    ir = stats.pop("ir", None)
+    if ir is not None:
+        print("\nIR:")
+        for line in ir:
+            print(line)
+    if args.emit != "ir":
+        print("\nCODE:")
+        code.write(sys.stdout)
+    report = stats.pop("passes", None)
+    print("\n# Stats:", stats)
+    if report is not None:
+        print()
+        for line in format_report(report):
+            print("# " + line)
\ No newline at end of file
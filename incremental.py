@@ -0,0 +1,321 @@
+import argparse
+import time
+from collections import OrderedDict
+
+from compiler import (K_LAB, K_MEM, OP_HLT, OP_JMP, OP_JUMPS, OP_LABEL, OP_RET, TEMP_RE,
+                      CodeGen, compile_ast, count_mem, kind_of, opnd, parse_result, simplify,
+                      val_of, walk_tree)
+
+
+# ============================================================
+# COMPILACIÓN INCREMENTAL
+# ============================================================
+#
+# Para recompilar muchas veces una expresión grande que cambia de a poco.
+# El árbol se corta en piezas de a lo sumo CHUNK operaciones; los
+# subárboles que quedan afuera de una pieza son huecos ($0, $1, ...) que
+# la pieza lee de memoria. Cada pieza se compila sola, con todos los
+# pases, como un fragmento (ver CodeGen.lower) y se guarda por su texto.
+# Al recompilar solo se compilan las piezas que no están guardadas; el
+# resto se enlaza: los temporales y labels de cada fragmento se renombran
+# y los resultados de las piezas van a una pila de celdas.
+#
+# Un subárbol que se repite en el árbol (el CSE de ir_cse, pero entre
+# piezas) es una pieza compartida: se calcula una vez, donde aparece
+# primero, a su propia celda, y las demás apariciones la leen de ahí.
+#
+# El costo: el orden de evaluación y los pases de asm no cruzan el borde
+# de una pieza, y cada borde es un store y una carga. Sin análisis de
+# rangos, porque un hueco puede valer cualquier cosa: tampoco hay cota
+# para un dividendo y / y % van por resta repetida.
+
+CHUNK = 32
+
+
+class Piece:
+    def __init__(self, tree, holes):
+        # tree: la pieza con los huecos como ("var", "$k"); holes: las
+        # piezas de esos huecos, en orden
+        self.tree = tree
+        self.holes = holes
+        self.key = repr(tree)
+        # pieza compartida: se calcula una sola vez (ver split_tree)
+        self.shared = False
+
+
+def rebuild(node, args):
+    kind = node[0]
+    if kind == "neg":
+        return ("neg", args[0])
+    if kind == "func":
+        return ("func", node[1], list(args))
+    if kind == "binop":
+        return ("binop", node[1], args[0], args[1])
+    return node
+
+
+def make_piece(region):
+    # region: subárbol con ("hole", pieza) donde se cortó
+    holes = []
+
+    def visit(node):
+        if node[0] != "hole":
+            return None
+        holes.append(node[1])
+        return ("var", f"${len(holes) - 1}")
+
+    return Piece(walk_tree(region, rebuild, visit), holes)
+
+
+def node_key(node, kids):
+    # forma de un nodo con sus hijos ya numerados
+    kind = node[0]
+    if kind in ("var", "const"):
+        return node
+    if kind == "neg":
+        return kind, kids
+    return kind, node[1], kids
+
+
+def shared_nodes(ast):
+    # numera los subárboles distintos (iguales = mismo número) y devuelve
+    # (números, los de operaciones que usa más de un nodo distinto)
+    ids = {}
+    uses = {}
+
+    def number(node, args):
+        key = node_key(node, tuple(args))
+        nid = ids.get(key)
+        if nid is None:
+            nid = ids[key] = len(ids)
+            for a in args:
+                uses[a] = uses.get(a, 0) + 1
+        return nid
+
+    walk_tree(ast, number)
+    leaves = {nid for key, nid in ids.items() if key[0] in ("var", "const")}
+    return ids, {nid for nid, n in uses.items() if n > 1 and nid not in leaves}
+
+
+def split_tree(ast, chunk=CHUNK):
+    # devuelve la pieza de la raíz. De abajo hacia arriba: si un nodo junto
+    # con lo que sigue sin cortar de sus hijos pasa de chunk operaciones,
+    # se cortan sus hijos más grandes. Solo depende del subárbol, así que
+    # un cambio no mueve los cortes fuera de su camino a la raíz (salvo
+    # cuando cambia qué se repite). Un subárbol repetido es siempre una
+    # pieza, la misma en todas sus apariciones
+    ids, shared = shared_nodes(ast)
+    pieces = {}
+
+    def combine(node, args):
+        nid = ids[node_key(node, tuple(a[2] for a in args))]
+        if not args:
+            return node, 0, nid
+        regions = [r for r, _, _ in args]
+        sizes = [s for _, s, _ in args]
+        total = 1 + sum(sizes)
+        while total > chunk:
+            i = max(range(len(sizes)), key=sizes.__getitem__)
+            regions[i] = ("hole", make_piece(regions[i]))
+            total -= sizes[i]
+            sizes[i] = 0
+        if nid not in shared:
+            return rebuild(node, regions), total, nid
+        if nid not in pieces:
+            pieces[nid] = make_piece(rebuild(node, regions))
+            pieces[nid].shared = True
+        return ("hole", pieces[nid]), 0, nid
+
+    region, _, _ = walk_tree(ast, combine)
+    if region[0] == "hole":
+        return region[1]
+    return make_piece(region)
+
+
+# ============================================================
+# FRAGMENTOS
+# ============================================================
+
+class Fragment:
+    def __init__(self, code):
+        # code: Code de una pieza compilada con fragment=True. Los labels
+        # que llevan a un HLT son la salida por error: van a la rutina de
+        # error del programa enlazado (el label local nlabels)
+        nlabels = len(code.labels.names)
+        err = set()
+        after = None
+        for i in range(len(code) - 1, -1, -1):
+            op, dst, _ = code[i]
+            if op == OP_LABEL:
+                if after == OP_HLT:
+                    err.add(dst)
+            else:
+                after = op
+        to_err = opnd(K_LAB, nlabels)
+
+        # un HLT al que se llega de largo es un salto al error (cfg cambia
+        # JMP error por HLT); si no, se llega solo por sus labels y sobra
+        instrs = []
+        falls = True
+        for op, dst, src in code:
+            if op == OP_LABEL:
+                if dst not in err:
+                    instrs.append((op, dst, src))
+                continue
+            if op == OP_HLT:
+                if falls:
+                    instrs.append((OP_JMP, to_err, 0))
+                falls = False
+                continue
+            if op in OP_JUMPS and dst in err:
+                dst = to_err
+            instrs.append((op, dst, src))
+            falls = op not in (OP_JMP, OP_RET)
+
+        self.instrs = instrs
+        self.cells = list(code.cells.names)
+        self.nlabels = nlabels
+        self.temps = max((int(c[1:]) for c in self.cells if TEMP_RE.match(c)), default=0)
+
+
+class IncrementalCompiler:
+    def __init__(self, chunk=CHUNK, maxsize=65536, **options):
+        # options: las de compile_ast para todas las piezas (level, mul,
+        # div, ...); maxsize: fragmentos guardados
+        self.chunk = chunk
+        self.maxsize = maxsize
+        self.options = dict(options, ranges=False, size=False, fragment=True, text=False,
+                            timing=False)
+        self.fragments = OrderedDict()
+        self.compiled = 0
+        self.reused = 0
+
+    def fragment(self, piece):
+        frag = self.fragments.get(piece.key)
+        if frag is not None:
+            self.reused += 1
+            self.fragments.move_to_end(piece.key)
+            return frag
+        self.compiled += 1
+        code, _ = compile_ast([("$r", piece.tree)], **self.options)
+        frag = self.fragments[piece.key] = Fragment(code)
+        while len(self.fragments) > self.maxsize:
+            self.fragments.popitem(last=False)
+        return frag
+
+    def compile(self, expr, text=True):
+        # devuelve (código, stats) como compile_to_asua
+        return self.compile_ast(simplify(parse_result(expr)), text)
+
+    def compile_ast(self, ast, text=True):
+        compiled, reused = self.compiled, self.reused
+        root = split_tree(ast, self.chunk)
+
+        gen = CodeGen()
+        code = gen.code
+        err = gen.error_label
+        slots = 0
+        npieces = 0
+        # pieza compartida ya calculada -> nombre provisorio de su celda
+        done = {}
+
+        # post-orden con pila explícita: la pieza deja su resultado en la
+        # celda base; sus huecos se calculan antes, de izquierda a derecha,
+        # en base+1, base+2, ... y sus temporales van después. El resultado
+        # no comparte celda con un hueco: los pases podrían mover una
+        # lectura del hueco después del store
+        stack = [(root, 0, False)]
+        while stack:
+            piece, base, ready = stack.pop()
+            if piece in done:
+                continue
+            if not ready:
+                stack.append((piece, base, True))
+                for k in range(len(piece.holes) - 1, -1, -1):
+                    stack.append((piece.holes[k], base + 1 + k, False))
+                continue
+
+            frag = self.fragment(piece)
+            npieces += 1
+            top = base + 1 + len(piece.holes)
+            slots = max(slots, top + frag.temps)
+
+            if piece.shared:
+                done[piece] = f"$s{len(done)}"
+            cells = []
+            for name in frag.cells:
+                if name == "$r":
+                    name = "result" if piece is root else done.get(piece, f"t{base + 1}")
+                elif name[0] == "$":
+                    k = int(name[1:])
+                    name = done.get(piece.holes[k], f"t{base + k + 2}")
+                elif TEMP_RE.match(name):
+                    name = f"t{top + int(name[1:])}"
+                cells.append(opnd(K_MEM, code.cells.intern(name)))
+            labels = [gen.new_label() for _ in range(frag.nlabels)]
+            labels.append(err)
+
+            words = code.words
+            for op, dst, src in frag.instrs:
+                k = kind_of(dst)
+                if k == K_MEM:
+                    dst = cells[val_of(dst)]
+                elif k == K_LAB:
+                    dst = labels[val_of(dst)]
+                if kind_of(src) == K_MEM:
+                    src = cells[val_of(src)]
+                words.extend((op, dst, src))
+
+        # las celdas de las piezas compartidas van después de la pila
+        names = code.cells.names
+        for k, name in enumerate(done.values()):
+            i = code.cells.ids.pop(name)
+            names[i] = f"t{slots + k + 1}"
+            code.cells.ids[names[i]] = i
+
+        # la rutina de error de CodeGen.lower, si algún fragmento salta ahí
+        gen.emit("HLT")
+        if any(dst == err for _, dst, _ in code):
+            gen.emit(":", err)
+            gen.moveA_imm(1)
+            gen.storeA("error")
+            gen.moveA_imm(0)
+            gen.storeA("result")
+            gen.emit("HLT")
+
+        reads, writes = count_mem(code)
+        stats = {
+            "lines": len(code),
+            "reads": reads,
+            "writes": writes,
+            "mem_accesses": reads + writes,
+            "slots": slots + len(done),
+            "fragments": npieces,
+            "shared": len(done),
+            "compiled": self.compiled - compiled,
+            "reused": self.reused - reused,
+        }
+        if text:
+            code = code.lines()
+        return code, stats
+
+
+if __name__ == "__main__":
+    # python incremental.py versiones.txt: una versión de la expresión por
+    # línea, cada una recompilada sobre los fragmentos de las anteriores
+    ap = argparse.ArgumentParser(description="Recompilación incremental de una expresión que cambia")
+    ap.add_argument("file", help="versiones de la expresión, una por línea")
+    ap.add_argument("-O", dest="level", choices=("0", "1", "2", "s"), default=None)
+    ap.add_argument("--chunk", type=int, default=CHUNK, help="operaciones por pieza")
+    args = ap.parse_args()
+
+    inc = IncrementalCompiler(args.chunk, level=args.level)
+    with open(args.file, encoding="utf-8") as f:
+        for n, expr in enumerate(f, 1):
+            if not expr.strip():
+                continue
+            t0 = time.perf_counter()
+            _, stats = inc.compile(expr)
+            ms = 1000 * (time.perf_counter() - t0)
+            print(f"{n:>4} {ms:9.1f} ms  lines={stats['lines']} fragments={stats['fragments']} "
+                  f"shared={stats['shared']} compiled={stats['compiled']} reused={stats['reused']}")
@@ -0,0 +1,163 @@
+import sys
+
+from compiler import JUMPS, compile_to_asua, split_instr
+
+
+# ============================================================
+# SIMULADOR ASUA
+# ============================================================
+#
+# Ejecuta el código que emite compiler.py con el mismo modelo que usan
+# sus chequeos (CMP A,127 / JGT error): los registros guardan enteros y
+# los saltos comparan con signo el resultado de la última operación de la
+# ALU (CMP, ADD, SUB, AND, SHL, SHR).
+#
+# Modelo de ciclos: CYCLES[op] por instrucción + MEM_CYCLES por cada
+# acceso a memoria.
+
+CYCLES = {
+    "MOV": 1, "ADD": 1, "SUB": 1, "AND": 1, "SHL": 1, "SHR": 1, "CMP": 1,
+    "JMP": 1, "JEQ": 1, "JNE": 1, "JGT": 1, "JGE": 1, "JLT": 1, "JLE": 1,
+    "CALL": 2, "RET": 2, "HLT": 1,
+}
+MEM_CYCLES = 1
+
+INPUTS = ("a", "b", "c", "d", "e", "f", "g")
+
+
+def operand(opnd, labels):
+    if opnd is None:
+        return None
+    if opnd in ("A", "B"):
+        return ("reg", opnd)
+    if opnd.startswith("("):
+        return ("mem", opnd[1:-1])
+    if opnd in labels:
+        return ("label", labels[opnd])
+    return ("imm", int(opnd))
+
+
+class Program:
+    def __init__(self, code):
+        labels = {}
+        n = 0
+        for line in code:
+            if line.endswith(":"):
+                labels[line[:-1]] = n
+            else:
+                n += 1
+
+        self.instrs = []
+        for line in code:
+            op, dst, src = split_instr(line)
+            if op == ":":
+                continue
+            if op not in CYCLES:
+                raise ValueError(f"Instrucción no soportada: {line}")
+            d = operand(dst, labels)
+            s = operand(src, labels)
+            mem = sum(1 for o in (d, s) if o is not None and o[0] == "mem")
+            cost = CYCLES[op] + MEM_CYCLES * mem
+            self.instrs.append((op, d, s, cost))
+
+    def run(self, inputs, max_steps=1000000):
+        mem = {name: 0 for name in INPUTS}
+        mem.update(inputs)
+        mem.setdefault("zero", 0)
+        mem["result"] = 0
+        mem["error"] = 0
+
+        regs = {"A": 0, "B": 0}
+        flags = 0
+        stack = []
+        pc = 0
+        steps = cycles = reads = writes = 0
+        instrs = self.instrs
+
+        def value(o):
+            nonlocal reads
+            kind, x = o
+            if kind == "reg":
+                return regs[x]
+            if kind == "mem":
+                reads += 1
+                return mem.get(x, 0)
+            return x
+
+        while True:
+            if steps >= max_steps:
+                raise RuntimeError(f"Se superó el límite de {max_steps} instrucciones")
+            op, d, s, cost = instrs[pc]
+            steps += 1
+            cycles += cost
+            pc += 1
+
+            if op == "MOV":
+                v = value(s)
+                if d[0] == "mem":
+                    mem[d[1]] = v
+                    writes += 1
+                else:
+                    regs[d[1]] = v
+            elif op == "ADD":
+                flags = regs[d[1]] = regs[d[1]] + value(s)
+            elif op == "SUB":
+                flags = regs[d[1]] = regs[d[1]] - value(s)
+            elif op == "AND":
+                flags = regs[d[1]] = regs[d[1]] & value(s)
+            elif op == "SHL":
+                flags = regs[d[1]] = value(s) << 1
+            elif op == "SHR":
+                flags = regs[d[1]] = value(s) >> 1
+            elif op == "CMP":
+                flags = value(d) - value(s)
+            elif op in JUMPS:
+                if (op == "JMP"
+                        or (op == "JEQ" and flags == 0)
+                        or (op == "JNE" and flags != 0)
+                        or (op == "JGT" and flags > 0)
+                        or (op == "JGE" and flags >= 0)
+                        or (op == "JLT" and flags < 0)
+                        or (op == "JLE" and flags <= 0)):
+                    pc = d[1]
+            elif op == "CALL":
+                stack.append(pc)
+                pc = d[1]
+            elif op == "RET":
+                pc = stack.pop()
+            elif op == "HLT":
+                break
+
+        return {
+            "result": mem["result"],
+            "error": mem["error"],
+            "instructions": steps,
+            "cycles": cycles,
+            "reads": reads,
+            "writes": writes,
+            "mem_accesses": reads + writes,
+            "memory": mem,
+        }
+
+
+def simulate(code, inputs, max_steps=1000000):
+    return Program(code).run(inputs, max_steps)
+
+
+if __name__ == "__main__":
+    # python simulator.py "result = a*b" a=3 b=-4
+    if len(sys.argv) > 1:
+        expr = sys.argv[1]
+        assigns = sys.argv[2:]
+    else:
+        expr = input("Expr: ")
+        assigns = input("Entradas (a=1 b=2 ...): ").split()
+
+    inputs = {}
+    for item in assigns:
+        name, _, val = item.partition("=")
+        inputs[name.strip()] = int(val)
+
+    code, stats = compile_to_asua(expr)
+    print("# Estático:", {k: stats[k] for k in ("lines", "reads", "writes", "mem_accesses")})
+    print("# Dinámico:", simulate(code, inputs))
@@ -0,0 +1,297 @@
+import argparse
+import heapq
+import itertools
+import json
+import random
+
+import numpy as np
+
+from compiler import SUPEROPT_FILE, compile_ast, shape_key, split_instr
+from simulator import Program
+from sweep import reference, run_lanes
+
+
+# ============================================================
+# SUPEROPTIMIZADOR OFFLINE
+# ============================================================
+#
+# Para cada forma chica de neg/abs/max/min (ver compiler.shape_key)
+# busca el programa ASUA más barato que deja el resultado en A, con
+# costo = instrucciones + operandos de memoria (el mismo modelo de
+# ciclos del simulador). La búsqueda es de costo uniforme sobre los
+# prefijos, ejecutados sobre un conjunto de vectores de prueba: dos
+# prefijos que dejan todos los carriles en el mismo estado son
+# equivalentes y se queda el más barato. Cada candidato se verifica
+# después sobre las 65536 entradas (x, y) antes de guardarlo.
+#
+#   python superopt.py            # regenera superopt_table.json
+
+TABLE_VERSION = 1
+
+OPS = ("neg", "abs", "max", "min")
+ARITY = {"neg": 1, "abs": 1, "max": 2, "min": 2}
+
+CONDS = ("JEQ", "JNE", "JGT", "JGE", "JLT", "JLE")
+MAX_SKIP = 3
+
+# más allá de este costo la búsqueda explota en memoria; las formas que
+# no bajan de acá se quedan con el código genérico
+MAX_COST = 10
+
+# instrucciones candidatas: (texto, costo)
+BASIC = [
+    ("MOV A,(X)", 2), ("MOV A,(Y)", 2), ("MOV B,(X)", 2), ("MOV B,(Y)", 2),
+    ("MOV A,B", 1), ("MOV B,A", 1), ("MOV A,0", 1), ("MOV B,0", 1),
+    ("ADD A,B", 1), ("SUB A,B", 1), ("CMP A,B", 1), ("CMP A,0", 1),
+]
+JUMP_INSTRS = [(f"{c} +{k}", 1) for c in CONDS for k in range(1, MAX_SKIP + 1)]
+JUMP_TEXTS = {i for i, _ in JUMP_INSTRS}
+
+
+# ============================================================
+# FORMAS
+# ============================================================
+
+def trees(n_ops):
+    # árboles con exactamente n_ops operaciones; hojas "?" sin nombre
+    if n_ops == 0:
+        yield "?"
+        return
+    for op in OPS:
+        if ARITY[op] == 1:
+            for sub in trees(n_ops - 1):
+                if op == "neg" and sub[0] == "neg":
+                    continue  # simplify ya saca -(-x)
+                yield ("neg", sub) if op == "neg" else ("func", op, [sub])
+        else:
+            for k in range(n_ops):
+                for l, r in itertools.product(trees(k), trees(n_ops - 1 - k)):
+                    yield ("func", op, [l, r])
+
+
+def name_leaves(tree, names):
+    # reemplaza las hojas "?" por las variables de names, en orden
+    if tree == "?":
+        return ("var", next(names))
+    if tree[0] == "neg":
+        return ("neg", name_leaves(tree[1], names))
+    return ("func", tree[1], [name_leaves(a, names) for a in tree[2]])
+
+
+def count_leaves(tree):
+    if tree == "?":
+        return 1
+    if tree[0] == "neg":
+        return count_leaves(tree[1])
+    return sum(count_leaves(a) for a in tree[2])
+
+
+def shapes(max_ops=2):
+    # clave -> AST con variables a/b (X -> a, Y -> b)
+    out = {}
+    for n_ops in range(1, max_ops + 1):
+        for tree in trees(n_ops):
+            n = count_leaves(tree)
+            for names in itertools.product("ab", repeat=n):
+                if names[0] != "a":
+                    continue  # X siempre es la primera hoja
+                ast = name_leaves(tree, iter(names))
+                shape = shape_key(ast)
+                if shape is not None and shape[0] not in out:
+                    out[shape[0]] = ast
+    return out
+
+
+# ============================================================
+# BÚSQUEDA
+# ============================================================
+
+def test_vectors(n=16, seed=0):
+    edges = (-128, -1, 0, 1, 127)
+    vecs = list(itertools.product(edges, edges))
+    rng = random.Random(seed)
+    while len(vecs) < len(edges) ** 2 + n:
+        vecs.append((rng.randint(-128, 127), rng.randint(-128, 127)))
+    return vecs
+
+
+def step(lanes, instr, vecs):
+    # aplica instr a cada carril (A, B, flags, saltos pendientes);
+    # None = valor desconocido. Devuelve None si el programa depende de
+    # algo desconocido
+    op, dst, src = split_instr(instr)
+    out = []
+    for (A, B, F, skip), (x, y) in zip(lanes, vecs):
+        if skip:
+            out.append((A, B, F, skip - 1))
+            continue
+        if op in CONDS:
+            if F is None:
+                return None
+            take = {"JEQ": F == 0, "JNE": F != 0, "JGT": F > 0,
+                    "JGE": F >= 0, "JLT": F < 0, "JLE": F <= 0}[op]
+            out.append((A, B, F, int(dst[1:]) if take else 0))
+            continue
+        regs = {"A": A, "B": B}
+        v = {"(X)": x, "(Y)": y, "A": A, "B": B}.get(src)
+        if v is None and src not in ("A", "B"):
+            v = int(src)
+        if op == "MOV":
+            regs[dst] = v
+        else:
+            a = regs[dst]
+            if a is None or v is None:
+                return None
+            r = a + v if op == "ADD" else a - v
+            if op == "CMP":
+                F = r
+            else:
+                regs[dst] = F = r
+        out.append((regs["A"], regs["B"], F, 0))
+    return tuple(out)
+
+
+def search(targets, vecs, bound):
+    # targets: huella (tupla de A por carril) -> [claves]
+    # genera (clave, código, costo) de menor a mayor costo, cada vez que un
+    # prefijo completo deja en A la huella de alguna forma; bound() es el
+    # costo máximo que todavía interesa (cambia a medida que se encuentran)
+    start = tuple((None, None, None, 0) for _ in vecs)
+    best = {start: 0}
+    parent = {start: None}
+    heap = [(0, 0, start)]
+    tie = itertools.count(1)
+
+    while heap:
+        cost, _, state = heapq.heappop(heap)
+        if best[state] < cost:
+            continue
+        max_cost = bound()
+        if cost > max_cost:
+            return
+
+        if all(s[3] == 0 for s in state) and state[0][0] is not None:
+            fp = tuple(s[0] for s in state)
+            if fp in targets:
+                code = []
+                node = state
+                while parent[node] is not None:
+                    node, instr = parent[node]
+                    code.append(instr)
+                for key in targets[fp]:
+                    yield key, code[::-1], cost
+
+        last = parent[state][1] if parent[state] else None
+        for instr, c in BASIC + JUMP_INSTRS:
+            # los saltos solo después de algo que fija los flags
+            if instr in JUMP_TEXTS and (last is None or split_instr(last)[0] not in ("ADD", "SUB", "CMP")):
+                continue
+            if cost + c > max_cost:
+                continue
+            nxt = step(state, instr, vecs)
+            if nxt is None:
+                continue
+            if nxt in best and best[nxt] <= cost + c:
+                continue
+            best[nxt] = cost + c
+            parent[nxt] = (state, instr)
+            heapq.heappush(heap, (cost + c, next(tie), nxt))
+
+
+# ============================================================
+# VERIFICACIÓN Y COSTO GENÉRICO
+# ============================================================
+
+def with_labels(code):
+    # "JGE +2" -> "JGE @0" con "@0:" dos instrucciones después
+    at = {}
+    for i, instr in enumerate(code):
+        op, dst, _ = split_instr(instr)
+        if op in CONDS:
+            at.setdefault(i + 1 + int(dst[1:]), f"@{len(at)}")
+    out = []
+    for i, instr in enumerate(code):
+        if i in at:
+            out.append(at[i] + ":")
+        op, dst, _ = split_instr(instr)
+        if op in CONDS:
+            instr = f"{op} {at[i + 1 + int(dst[1:])]}"
+        out.append(instr)
+    if len(code) in at:
+        out.append(at[len(code)] + ":")
+    return out
+
+
+def verify(ast, code):
+    # corre el fragmento sobre todas las (x, y) contra la referencia
+    prog = [line.replace("(X)", "(a)").replace("(Y)", "(b)").replace("@", "S") for line in code]
+    prog = Program(prog + ["MOV (result),A", "HLT"])
+    x, y = np.meshgrid(np.arange(-128, 128), np.arange(-128, 128))
+    env = {"a": x.ravel().astype(np.int64), "b": y.ravel().astype(np.int64)}
+    out = run_lanes(prog, env)
+    exp, _, _ = reference(ast, env)
+    return bool((out["result"] == exp).all() and not out["timeout"].any())
+
+
+def cost(code):
+    total = 0
+    for line in code:
+        op, dst, src = split_instr(line)
+        if op == ":":
+            continue
+        total += 1 + sum(1 for o in (dst, src) if o is not None and o.startswith("("))
+    return total
+
+
+def generic_cost(ast):
+    # lo que emite CodeGen sin tabla, hasta guardar el resultado
+    code, _ = compile_ast(ast, superopt=False)
+    return cost(code[:code.index("MOV (result),A")])
+
+
+# ============================================================
+# TABLA
+# ============================================================
+
+def build(max_ops=2, max_cost=MAX_COST, verbose=False):
+    forms = shapes(max_ops)
+    generic = {key: generic_cost(ast) for key, ast in forms.items()}
+
+    vecs = test_vectors()
+    env = {"a": np.array([v[0] for v in vecs], np.int64),
+           "b": np.array([v[1] for v in vecs], np.int64)}
+    targets = {}
+    for key, ast in forms.items():
+        fp = tuple(int(v) for v in reference(ast, env)[0])
+        targets.setdefault(fp, []).append(key)
+
+    entries = {}
+    pending = set(forms)
+    bound = lambda: min(max_cost, max((generic[k] for k in pending), default=0) - 1)
+    for key, code, c in search(targets, vecs, bound):
+        if key not in pending or c >= generic[key]:
+            continue
+        code = with_labels(code)
+        if not verify(forms[key], code):
+            continue
+        pending.discard(key)
+        entries[key] = {"code": code, "cost": c, "generic_cost": generic[key]}
+        if verbose:
+            print(f"{key:<20} {generic[key]:>3} -> {c:<3} {'; '.join(code)}")
+        if not pending:
+            break
+    return {"version": TABLE_VERSION, "entries": dict(sorted(entries.items()))}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Genera la tabla del superoptimizador")
+    ap.add_argument("--output", default=SUPEROPT_FILE)
+    ap.add_argument("--max-ops", type=int, default=2)
+    ap.add_argument("--max-cost", type=int, default=MAX_COST)
+    args = ap.parse_args()
+
+    table = build(args.max_ops, args.max_cost, verbose=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(table, f, indent=1)
+        f.write("\n")
+    print(f"# {len(table['entries'])} formas guardadas en {args.output}")
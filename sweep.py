@@ -0,0 +1,318 @@
+import argparse
+
+import numpy as np
+
+from compiler import compile_ast, parse_result, simplify
+from simulator import INPUTS, Program
+
+
+# ============================================================
+# BARRIDO EXHAUSTIVO DEL ESPACIO DE ENTRADAS (NUMPY)
+# ============================================================
+#
+# Corre un programa compilado sobre todas las combinaciones de sus
+# entradas a la vez: cada combinación es un "carril" de los arrays y
+# todos avanzan juntos. En cada paso se ejecuta la instrucción del menor
+# pc entre los carriles activos (los que van adelante esperan), así los
+# carriles que se separan en un salto se vuelven a juntar enseguida.
+
+STACK_DEPTH = 16
+
+
+def run_lanes(prog, env, max_steps=100000):
+    # env: nombre -> array int64 con el valor de cada carril
+    n = len(next(iter(env.values())))
+    regs = {"A": np.zeros(n, np.int64), "B": np.zeros(n, np.int64)}
+    flags = np.zeros(n, np.int64)
+    pc = np.zeros(n, np.int64)
+    mem = {name: np.array(v, np.int64) for name, v in env.items()}
+    stack = np.zeros((STACK_DEPTH, n), np.int64)
+    sp = np.zeros(n, np.int64)
+
+    steps = np.zeros(n, np.int64)
+    cycles = np.zeros(n, np.int64)
+    reads = np.zeros(n, np.int64)
+    writes = np.zeros(n, np.int64)
+    active = np.ones(n, bool)
+    timeout = np.zeros(n, bool)
+
+    def cell(name):
+        if name not in mem:
+            mem[name] = np.zeros(n, np.int64)
+        return mem[name]
+
+    def value(o, idx):
+        kind, x = o
+        if kind == "reg":
+            return regs[x][idx]
+        if kind == "mem":
+            reads[idx] += 1
+            return cell(x)[idx]
+        return np.full(len(idx), x, np.int64)
+
+    while active.any():
+        cur = pc[active].min()
+        idx = np.nonzero(active & (pc == cur))[0]
+        op, d, s, cost = prog.instrs[cur]
+        steps[idx] += 1
+        cycles[idx] += cost
+        pc[idx] += 1
+
+        if op == "MOV":
+            v = value(s, idx)
+            if d[0] == "mem":
+                cell(d[1])[idx] = v
+                writes[idx] += 1
+            else:
+                regs[d[1]][idx] = v
+        elif op in ("ADD", "SUB", "AND", "SHL", "SHR"):
+            a = regs[d[1]][idx]
+            b = value(s, idx)
+            if op == "ADD":
+                r = a + b
+            elif op == "SUB":
+                r = a - b
+            elif op == "AND":
+                r = a & b
+            elif op == "SHL":
+                r = b << 1
+            else:
+                r = b >> 1
+            regs[d[1]][idx] = r
+            flags[idx] = r
+        elif op == "CMP":
+            flags[idx] = value(d, idx) - value(s, idx)
+        elif op == "JMP":
+            pc[idx] = d[1]
+        elif op in ("JEQ", "JNE", "JGT", "JGE", "JLT", "JLE"):
+            f = flags[idx]
+            take = {
+                "JEQ": f == 0, "JNE": f != 0, "JGT": f > 0,
+                "JGE": f >= 0, "JLT": f < 0, "JLE": f <= 0,
+            }[op]
+            pc[idx[take]] = d[1]
+        elif op == "CALL":
+            stack[sp[idx], idx] = pc[idx]
+            sp[idx] += 1
+            pc[idx] = d[1]
+        elif op == "RET":
+            sp[idx] -= 1
+            pc[idx] = stack[sp[idx], idx]
+        elif op == "HLT":
+            active[idx] = False
+
+        over = active & (steps >= max_steps)
+        if over.any():
+            timeout |= over
+            active &= ~over
+
+    return {
+        "result": cell("result"),
+        "error": cell("error"),
+        "instructions": steps,
+        "cycles": cycles,
+        "reads": reads,
+        "writes": writes,
+        "timeout": timeout,
+    }
+
+
+# ============================================================
+# REFERENCIA VECTORIZADA SOBRE EL AST
+# ============================================================
+
+def reference(node, env):
+    # devuelve (valor, overflow, div0) por carril, con la semántica del
+    # código generado
+    kind = node[0]
+    n = len(next(iter(env.values())))
+
+    if kind == "var":
+        return np.array(env[node[1]], np.int64), np.zeros(n, bool), np.zeros(n, bool)
+
+    if kind == "const":
+        return np.full(n, node[1], np.int64), np.zeros(n, bool), np.zeros(n, bool)
+
+    if kind == "neg":
+        x, ov, dz = reference(node[1], env)
+        return -x, ov, dz
+
+    if kind == "func":
+        parts = [reference(a, env) for a in node[2]]
+        ov = np.logical_or.reduce([p[1] for p in parts])
+        dz = np.logical_or.reduce([p[2] for p in parts])
+        if node[1] == "max":
+            return np.maximum(parts[0][0], parts[1][0]), ov, dz
+        if node[1] == "min":
+            return np.minimum(parts[0][0], parts[1][0]), ov, dz
+        return np.abs(parts[0][0]), ov, dz
+
+    op = node[1]
+    x, ovx, dzx = reference(node[2], env)
+    y, ovy, dzy = reference(node[3], env)
+    ov = ovx | ovy
+    dz = dzx | dzy
+
+    if op in ("+", "-"):
+        r = x + y if op == "+" else x - y
+        return r, ov | (r > 127), dz
+
+    if op == "*":
+        return x * y, ov | (np.abs(x) * np.abs(y) > 127), dz
+
+    # / y %: divisor 0 o negativo (con dividendo >= divisor) es error;
+    # dividendo < divisor da (0, dividendo)
+    zero = y == 0
+    small = x < y
+    neg = ~small & (y < 0)
+    safe = np.where(zero | small | neg, 1, y)
+    num = np.where(small | zero | neg, 0, x)
+    if op == "/":
+        r = np.where(small, 0, num // safe)
+    else:
+        r = np.where(small, x, num % safe)
+    return r, ov | (neg & ~zero), dz | zero
+
+
+# ============================================================
+# BARRIDO
+# ============================================================
+
+def used_inputs(node, acc=None):
+    acc = set() if acc is None else acc
+    kind = node[0]
+    if kind == "var":
+        acc.add(node[1])
+    elif kind == "neg":
+        used_inputs(node[1], acc)
+    elif kind == "func":
+        for a in node[2]:
+            used_inputs(a, acc)
+    elif kind == "binop":
+        used_inputs(node[2], acc)
+        used_inputs(node[3], acc)
+    return acc
+
+
+def input_chunks(names, ranges, chunk):
+    # recorre el producto cartesiano de los rangos en bloques de carriles
+    axes = [np.arange(ranges[v][0], ranges[v][1] + 1, dtype=np.int64) for v in names]
+    sizes = [len(ax) for ax in axes]
+    total = int(np.prod(sizes)) if sizes else 1
+    for start in range(0, total, chunk):
+        flat = np.arange(start, min(start + chunk, total), dtype=np.int64)
+        env = {}
+        for v, ax, size in zip(reversed(names), reversed(axes), reversed(sizes)):
+            env[v] = ax[flat % size]
+            flat = flat // size
+        if not names:
+            # expresión sin entradas: un solo carril
+            env["a"] = np.zeros(len(flat), np.int64)
+        yield env
+
+
+def sweep(expr, ranges=None, chunk=1 << 18, max_steps=100000, **options):
+    # ranges: nombre -> (min, max); por defecto -128..127 para cada
+    # entrada que aparece en la expresión. Se compila con esos mismos
+    # rangos (salvo que options traiga ranges)
+    ast = simplify(parse_result(expr))
+    names = sorted(used_inputs(ast) & set(INPUTS))
+    full = {v: (-128, 127) for v in names}
+    full.update(ranges or {})
+
+    options.setdefault("ranges", full)
+    code, stats = compile_ast(ast, **options)
+    prog = Program(code)
+
+    total = 0
+    hist = np.zeros(0, np.int64)
+    cyc_sum = 0
+    cyc_max = 0
+    cyc_min = None
+    errors = overflows = div0 = timeouts = agree = 0
+    mismatches = []
+
+    for env in input_chunks(names, full, chunk):
+        out = run_lanes(prog, env, max_steps)
+        ref, ov, dz = reference(ast, env)
+        err = ov | dz
+        exp_result = np.where(err, 0, ref)
+        exp_error = err.astype(np.int64)
+
+        cyc = out["cycles"]
+        ok = (out["result"] == exp_result) & (out["error"] == exp_error) & ~out["timeout"]
+
+        total += len(cyc)
+        counts = np.bincount(cyc)
+        if len(counts) > len(hist):
+            counts[:len(hist)] += hist
+            hist = counts
+        else:
+            hist[:len(counts)] += counts
+        cyc_sum += int(cyc.sum())
+        cyc_max = max(cyc_max, int(cyc.max()))
+        cyc_min = int(cyc.min()) if cyc_min is None else min(cyc_min, int(cyc.min()))
+        errors += int(out["error"].sum())
+        overflows += int(ov.sum())
+        div0 += int((dz & ~ov).sum())
+        timeouts += int(out["timeout"].sum())
+        agree += int(ok.sum())
+
+        for i in np.nonzero(~ok)[0][:max(0, 5 - len(mismatches))]:
+            mismatches.append({
+                "inputs": {v: int(env[v][i]) for v in names},
+                "expected": (int(exp_result[i]), int(exp_error[i])),
+                "got": (int(out["result"][i]), int(out["error"][i])),
+            })
+
+    return {
+        "inputs": names,
+        "cases": total,
+        "lines": stats["lines"],
+        "cycles_min": cyc_min,
+        "cycles_max": cyc_max,
+        "cycles_mean": cyc_sum / total,
+        "histogram": {int(c): int(k) for c, k in enumerate(hist) if k},
+        "error_rate": errors / total,
+        "overflow_rate": overflows / total,
+        "div_zero_rate": div0 / total,
+        "timeouts": timeouts,
+        "agreement": agree / total,
+        "mismatches": mismatches,
+    }
+
+
+def parse_range(text):
+    lo, _, hi = text.partition(":")
+    return int(lo), int(hi)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Barrido exhaustivo de entradas de un programa ASUA")
+    ap.add_argument("expr")
+    ap.add_argument("--range", action="append", default=[], metavar="VAR=MIN:MAX",
+                    help="rango de una entrada (por defecto -128:127)")
+    ap.add_argument("--chunk", type=int, default=1 << 18)
+    ap.add_argument("--bins", type=int, default=16, help="barras del histograma impreso")
+    args = ap.parse_args()
+
+    ranges = {}
+    for item in args.range:
+        name, _, rng = item.partition("=")
+        ranges[name] = parse_range(rng)
+
+    rep = sweep(args.expr, ranges, args.chunk)
+    for key in ("inputs", "cases", "lines", "cycles_min", "cycles_max", "cycles_mean",
+                "error_rate", "overflow_rate", "div_zero_rate", "timeouts", "agreement"):
+        print(f"{key:>14}: {rep[key]}")
+
+    # histograma agrupado en --bins barras
+    cyc = np.array(list(rep["histogram"].keys()))
+    cnt = np.array(list(rep["histogram"].values()))
+    counts, edges = np.histogram(cyc, bins=args.bins, weights=cnt)
+    width = max(counts.max(), 1)
+    for k, lo, hi in zip(counts, edges, edges[1:]):
+        bar = "#" * int(40 * k / width)
+        print(f"{lo:8.0f}-{hi:<8.0f} {int(k):>9} {bar}")
+    for m in rep["mismatches"]:
+        print("# DISCREPANCIA", m)